@@ -1,22 +1,39 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from mne import filter
-from mne.time_frequency import tfr_array_morlet
-from scipy import signal, fftpack
+from mne.time_frequency import tfr_array_morlet, morlet
+from scipy import signal
 from sklearn.base import BaseEstimator, TransformerMixin
 
+from . import fft_utils, resample
+from .utils import RollingWindow
+
 
 class FilterbankExtractor(BaseEstimator, TransformerMixin):
     """
     用于提取滤波器组特征
     """
-    def __init__(self, sfreq, filter_banks):
+    def __init__(self, sfreq, filter_banks, target_fs=None):
         """
-        初始化函数接收两个参数：`sfreq` 和 `filter_banks`。
+        初始化函数接收以下参数：
             `sfreq` 是信号的采样频率。
             `filter_banks` 是一个包含多个频率的数组，这些频率定义了要应用的滤波器组。
+            `target_fs` 不为 None 时，功率在输出前一次性多相抗混叠降采样到该采样率。
         """
         self.sfreq = sfreq
         self.filter_banks = filter_banks
+        self.target_fs = target_fs
+        # wavelets are built once and pickled with the model
+        self.wavelet_bank = MorletBank(sfreq, filter_banks, np.asarray(filter_banks) / 4)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        # models pickled before the wavelet bank was introduced
+        if 'wavelet_bank' not in state:
+            self.wavelet_bank = MorletBank(self.sfreq, self.filter_banks, np.asarray(self.filter_banks) / 4)
+        self.__dict__.setdefault('target_fs', None)
     
     def fit(self, X, y=None):
         """
@@ -29,55 +46,218 @@ class FilterbankExtractor(BaseEstimator, TransformerMixin):
         transform 方法接收输入数据 X 并使用 filterbank_extractor 函数对其进行变换，然后返回变换后的数据。
             这个方法主要用于将定义的滤波器组应用于输入数据，以提取频率特征。
         """
-        return filterbank_extractor(X, self.sfreq, self.filter_banks, reshape_freqs_dim=True)
+        power = filterbank_extractor(X, self.sfreq, self.filter_banks, reshape_freqs_dim=True,
+                                     wavelet_bank=self.wavelet_bank)
+        return decimate_poly(power, self.sfreq, self.target_fs)
+
+    def edge_samples(self, tol=1e-3):
+        """窗口边缘影响特征的样本数：最长小波的半长"""
+        return max(len(w) for w in self.wavelet_bank.wavelets) // 2
+
+
+def decimate_poly(data, sfreq, target_fs, axis=-1):
+    """
+    一次多相抗混叠滤波 + 降采样，结果与 scipy.signal.resample_poly(padtype='line') 一致，
+    用于包络、功率等慢变特征，边缘按直线外推填充，避免零填充导致两端特征下沉。
+    计算由 resample.resample_poly 完成（窗长固定时为缓存的矩阵，一次矩阵乘法）。
+        data: ndarray (..., n_times)
+        sfreq: 原采样率
+        target_fs: 目标采样率，None 或与 sfreq 相同时原样返回
+    return: ndarray (..., ceil(n_times * target_fs / sfreq))，精度与输入相同
+    """
+    if target_fs is None or target_fs == sfreq:
+        return data
+    up, down = resample.poly_ratio(sfreq, target_fs)
+    return resample.resample_poly(data, up, down, axis=axis)
 
 
-def filterbank_extractor(data, sfreq, filter_banks, reshape_freqs_dim=False):
+def filterbank_extractor(data, sfreq, filter_banks, reshape_freqs_dim=False, wavelet_bank=None):
     """
     filterbank_extractor 是一个独立的函数，负责具体的特征提取过程。
         data: 输入数据。
         sfreq: 采样频率。
         filter_banks: 定义了要提取的频率带的数组。
         reshape_freqs_dim: 一个布尔值，指定是否要重新塑形频率维度，默认为 False。   
+        wavelet_bank: 预先构建的 MorletBank，给出时不再调用 tfr_array_morlet，结果相同。
     
     处理步骤
     1. 计算每个滤波器的周期数 n_cycles，这里简单地将 filter_banks 除以4。
     2. 使用 tfr_array_morlet 函数计算数据的时频表示。这个函数应用Morlet小波变换，用于计算指定频率的平均功率。
     3. 默认情况下，输出的功率维度是 (n_ch, n_freqs, n_times)。如果 reshape_freqs_dim 为 True，则将功率数组重塑，以便频率维度和时间维度合并。
     """
-    n_cycles = filter_banks / 4
-    power = tfr_array_morlet(data[None],
-                            sfreq=sfreq,
-                            freqs=filter_banks,
-                            n_cycles=n_cycles,
-                            output='avg_power',
-                            verbose=False)
-    # (n_ch, n_freqs, n_times)
+    if wavelet_bank is not None:
+        power = wavelet_bank.power(data)
+    else:
+        n_cycles = filter_banks / 4
+        power = tfr_array_morlet(data[None],
+                                sfreq=sfreq,
+                                freqs=filter_banks,
+                                n_cycles=n_cycles,
+                                output='avg_power',
+                                verbose=False)
+    # (n_ch, n_freqs, n_times), (n_epochs, n_ch, n_freqs, n_times) for batched input with wavelet_bank
     if reshape_freqs_dim:
-        power = power.reshape((-1, power.shape[-1]))
+        power = power.reshape(power.shape[:-3] + (-1, power.shape[-1]))
     return power
 
 
+class MorletBank:
+    """
+    预先构建的 Morlet 小波组，输出与 tfr_array_morlet(use_fft=True, zero_mean=False) 的功率一致。
+    小波在构造时生成一次，对每个窗长缓存一次小波的频谱（卷积结果的居中平移折算为相位），
+    所有频率、所有通道共用一次 fft。频谱最多保留 MAX_PLANS 个窗长（最近使用）；
+    频域乘积超过 MAX_CHUNK_SIZE 个元素时（整段记录）按频率分块做 ifft，结果直接写入输出，
+    不会一次生成 (..., n_freqs, n_fft) 的复数数组。所有频率的频谱本身超过 MAX_CHUNK_SIZE 时不缓存，
+    随分块逐块生成。
+    Args:
+        sfreq: 采样率
+        freqs: 频率数组
+        n_cycles: 每个频率的周期数
+    """
+    MAX_PLANS = 4
+    MAX_CHUNK_SIZE = 2 ** 22
+
+    def __init__(self, sfreq, freqs, n_cycles=7.):
+        self.sfreq = sfreq
+        self.freqs = freqs
+        self.n_cycles = n_cycles
+        self.wavelets = morlet(sfreq, freqs, n_cycles)
+        self._plans = OrderedDict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_plans'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._plans = OrderedDict()
+
+    def _spectra(self, n_fft, freqs):
+        """freqs 切片内小波的频谱 (n_chunk, n_fft)"""
+        wavelets = self.wavelets[freqs]
+        k = np.arange(n_fft)
+        spectra = np.empty((len(wavelets), n_fft), dtype=np.complex128)
+        for i, w in enumerate(wavelets):
+            # mode='same' keeps the centre part of the full convolution
+            start = (len(w) - 1) // 2
+            spectra[i] = fft_utils.fft(w, n_fft) * np.exp(2j * np.pi * k * start / n_fft)
+        return spectra
+
+    def _plan(self, n_times):
+        """(n_fft, spectra)，整段记录的 spectra 为 None"""
+        if n_times in self._plans:
+            self._plans.move_to_end(n_times)
+            return self._plans[n_times]
+        n_fft = fft_utils.next_fast_len(n_times + max(len(w) for w in self.wavelets) - 1)
+        if len(self.wavelets) * n_fft > self.MAX_CHUNK_SIZE:
+            return n_fft, None
+        self._plans[n_times] = (n_fft, self._spectra(n_fft, slice(None)))
+        if len(self._plans) > self.MAX_PLANS:
+            self._plans.popitem(last=False)
+        return self._plans[n_times]
+
+    def _chunks(self, data):
+        """逐块给出 (频率切片, 复数时频结果 (..., n_chunk, n_times))"""
+        n_times = data.shape[-1]
+        n_fft, spectra = self._plan(n_times)
+        spectrum = fft_utils.fft(data, n_fft, axis=-1)[..., None, :]
+        n_chunk = max(1, self.MAX_CHUNK_SIZE // spectrum.size)
+        for i in range(0, len(self.wavelets), n_chunk):
+            freqs = slice(i, i + n_chunk)
+            chunk_spectra = self._spectra(n_fft, freqs) if spectra is None else spectra[freqs]
+            tfr = fft_utils.ifft(spectrum * chunk_spectra, axis=-1)
+            yield freqs, tfr[..., :n_times]
+
+    def transform(self, data):
+        """
+        Args:
+            data (ndarray): (..., n_times)
+        Returns:
+            tfr (ndarray): complex, (..., n_freqs, n_times)
+        """
+        tfr = np.empty(data.shape[:-1] + (len(self.wavelets), data.shape[-1]), dtype=np.complex128)
+        for freqs, chunk in self._chunks(data):
+            tfr[..., freqs, :] = chunk
+        return tfr
+
+    def power(self, data):
+        """
+        Args:
+            data (ndarray): (..., n_times)
+        Returns:
+            power (ndarray): (..., n_freqs, n_times)
+        """
+        power = np.empty(data.shape[:-1] + (len(self.wavelets), data.shape[-1]))
+        for freqs, chunk in self._chunks(data):
+            out = power[..., freqs, :]
+            np.abs(chunk, out=out)
+            np.square(out, out=out)
+        return power
+
+
 class FeatExtractor:
     """
     FeatExtractor 是主要的特征提取器类，负责协调低频带（LFB）和高伽马（HG）频带特征的提取。
     """
-    def __init__(self, sfreq, lfb_bands, hg_bands):
+    def __init__(self, sfreq, lfb_bands, hg_bands, dtype=np.float64, target_fs=None, n_workers=1, lfb_phase='zero'):
         """
         初始化函数，设置采样频率和特定频带的参数。
             sfreq: 信号的采样频率。
             lfb_bands: 低频带参数，如果不为None，则用于LFB特征提取。
             hg_bands: 高伽马频带参数，如果不为None，则用于HG特征提取。
+            dtype: 输出特征的精度，np.float32 时 FIR 滤波和包络在单精度下计算，
+                IIR 滤波的递推仍在双精度下进行，只有输出为单精度。
+            target_fs: 不为 None 时，所有特征在输出前一次性多相抗混叠降采样到该采样率（decimate_poly），
+                下游的数组、协方差计算随之缩小。适用于包络等慢变特征；低频带特征是带通后的原始信号，
+                频带上限不低于 target_fs / 2 时会被抗混叠滤波完全滤除，此时抛出 ValueError。
+            n_workers: 大于 1 时各个低频带和高伽马滤波器组在线程池中并行计算
+                （sosfilt 与 FFT 计算时释放 GIL）。线程池在第一次 transform 时创建并一直复用，不随模型保存。
+                数据量很小时线程调度的开销可能超过收益，参考 benchmarks/feature_extractor_threads.py。
+            lfb_phase: 低频带滤波的相位，见 LFPExtractor。'forward' 为因果滤波，在线时低频带特征由
+                StreamingLFPExtractor 随数据到达逐块计算（SlidingFeatureCache），与对连续数据训练时的特征一致；
+                这样的模型应对连续数据提取特征后再切分 epoch（data_evaluation 给出 events），
+                逐窗口因果滤波时每个窗口开头有从零状态开始的暂态。
         根据 lfb_bands 和 hg_bands 的值，决定是否初始化相应的特征提取器。
 
         """
+        if target_fs is not None and lfb_bands is not None and max(b[1] for b in lfb_bands) >= target_fs / 2:
+            raise ValueError(f'low frequency bands up to {max(b[1] for b in lfb_bands)}Hz can not be decimated '
+                             f'to {target_fs}Hz, use target_fs=None or drop the lfb bands')
         self.sfreq = sfreq
+        self.dtype = dtype
+        self.target_fs = target_fs
+        self.n_workers = n_workers
+        self._executor = None
         self.use_lfb = lfb_bands is not None
         self.use_hgb = hg_bands is not None
         if self.use_lfb:
-            self.lfb_extractor = LFPExtractor(sfreq, lfb_bands)
+            self.lfb_extractor = LFPExtractor(sfreq, lfb_bands, dtype=dtype, phase=lfb_phase)
         if self.use_hgb:
-            self.hgs_extractor = HGExtractor(sfreq, hg_bands)
+            self.hgs_extractor = HGExtractor(sfreq, hg_bands, dtype=dtype)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('dtype', np.float64)
+        self.__dict__.setdefault('target_fs', None)
+        self.__dict__.setdefault('n_workers', 1)
+        self.__dict__.setdefault('_executor', None)
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.n_workers, thread_name_prefix='feat_extractor')
+        return self._executor
+
+    def close(self):
+        """关闭线程池，之后调用 transform 会重新创建"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
 
     def fit(self, X, y=None):
         """为了与scikit-learn兼容而定义的方法，不进行任何操作，仅返回自身实例。"""
@@ -87,54 +267,355 @@ class FeatExtractor:
         """
         对输入数据 X 进行特征提取。
         如果启用了LFB或HG特征提取，则分别调用相应的提取器，并将特征数组合并。   
+        X 可以是单个连续试次 (n_ch, n_times)，也可以是多个 epoch (n_epochs, n_ch, n_times)，
+        后者所有 epoch 沿最后一维一次滤波，返回 (n_epochs, n_bands * n_ch, n_times)。
         """
-        feature = []
+        if self.n_workers > 1:
+            pool = self._pool()
+            futures = []
+            if self.use_lfb:
+                futures.extend(pool.submit(self.lfb_extractor.transform_band, i, X)
+                               for i in range(len(self.lfb_extractor.iir_params)))
+            if self.use_hgb:
+                # all high gamma bands share one FFT, a single task
+                futures.append(pool.submit(self.hgs_extractor.transform, X))
+            feature = [f.result() for f in futures]
+        else:
+            feature = []
+            if self.use_lfb:
+                feature.append(self.lfb_extractor.transform(X))
+            if self.use_hgb:
+                feature.append(self.hgs_extractor.transform(X))
+        return decimate_poly(np.concatenate(feature, axis=-2), self.sfreq, self.target_fs)
+
+    def edge_samples(self, tol=1e-3):
+        """窗口边缘影响特征的样本数，各提取器中最长的一个，见 LFPExtractor.edge_samples"""
+        n = 0
         if self.use_lfb:
-            feature.append(self.lfb_extractor.transform(X))
+            n = max(n, self.lfb_extractor.edge_samples(tol))
         if self.use_hgb:
-            feature.append(self.hgs_extractor.transform(X))
-        return np.concatenate(feature, axis=0)
+            n = max(n, self.hgs_extractor.edge_samples(tol))
+        return n
 
 
 class HGExtractor:
-    def __init__(self, sfreq, hg_bands):
+    """
+    高伽马频带包络特征
+    envelope='fft' 时带通滤波与 Hilbert 变换在频域一次完成（FIRFilterBank.envelope），
+    envelope='hilbert' 时先滤波再对每个频带做 fast_hilbert，与旧版本模型的特征完全一致。
+    """
+    def __init__(self, sfreq, hg_bands, envelope='fft', dtype=np.float64):
+        if envelope not in ('fft', 'hilbert'):
+            raise ValueError(f'envelope must be "fft" or "hilbert", got {envelope}')
         self.sfreq = sfreq
         self.hg_bands = hg_bands
+        self.envelope = envelope
+        self.dtype = dtype
+        self.filter_bank = FIRFilterBank(sfreq, hg_bands, dtype=dtype)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # models pickled before the filter bank was introduced
+        if 'filter_bank' not in state:
+            self.filter_bank = FIRFilterBank(self.sfreq, self.hg_bands)
+        if 'envelope' not in state:
+            self.envelope = 'hilbert'
+        self.__dict__.setdefault('dtype', np.float64)
 
     def transform(self, data):
         """
-        data: single trial data (n_ch, n_times)
+        data: single trial data (n_ch, n_times) or epochs (n_epochs, n_ch, n_times)
+        return: (n_bands * n_ch, n_times) or (n_epochs, n_bands * n_ch, n_times)
         """
-        hg_data = []
-        for b in self.hg_bands:
-            filter_signal = filter.filter_data(data, self.sfreq, l_freq=b[0], h_freq=b[1], verbose=False, n_jobs=4)
-            signal_power = np.abs(fast_hilbert(data=filter_signal))
-            hg_data.append(signal_power)
-        hg_data = np.concatenate(hg_data, axis=0)
-        return hg_data
-        
+        if self.envelope == 'fft':
+            hg_data = self.filter_bank.envelope(data)
+        else:
+            # (n_bands, ..., n_ch, n_times)
+            filter_signal = self.filter_bank.transform(data)
+            hg_data = np.abs(fast_hilbert(data=filter_signal)).astype(self.dtype, copy=False)
+        return _stack_bands(hg_data)
+
+    def edge_samples(self, tol=1e-3):
+        """窗口边缘影响特征的样本数：最长 FIR 核的半长"""
+        return max(len(h) for h in self.filter_bank.kernels) // 2
+
+
+class FIRFilterBank:
+    """
+    预先设计好的 FIR 带通滤波器组，输出与 mne.filter.filter_data(method='fir', phase='zero') 一致。
+    滤波核在构造时设计一次，对每个窗长缓存一次核的频谱；
+    所有频带、所有通道共用一次 rfft、一次频域乘法和一次 irfft。
+    dtype=np.float32 时输入转为单精度，FFT 与核的频谱都为 complex64。
+    包络的频谱按窗长缓存，最多保留 MAX_ENVELOPE_PLANS 个窗长（最近使用），
+    工作缓冲区随计划保存，批量维度改变时重新分配，不会为每种输入形状各保留一份。
+    """
+    MAX_ENVELOPE_PLANS = 4
+
+    def __init__(self, sfreq, bands, dtype=np.float64):
+        self.sfreq = sfreq
+        self.bands = bands
+        self.dtype = dtype
+        self.kernels = [filter.create_filter(None, sfreq, b[0], b[1], verbose=False) for b in bands]
+        self._plans = {}
+        self._envelope_plans = OrderedDict()
+
+    def __getstate__(self):
+        # kernel spectra are cheap to rebuild, keep pickled models small
+        state = self.__dict__.copy()
+        state['_plans'] = {}
+        state['_envelope_plans'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._envelope_plans = OrderedDict()
+        self.__dict__.setdefault('dtype', np.float64)
+
+    @property
+    def _complex_dtype(self):
+        return np.result_type(self.dtype, np.complex64)
+
+    def _plan(self, n_times):
+        if n_times not in self._plans:
+            # same edge padding as mne (reflect_limited), the longest kernel decides
+            n_edge = max(max(min(len(h), n_times) - 1, 0) for h in self.kernels)
+            n_fft = fft_utils.next_fast_len(n_times + 2 * n_edge + max(len(h) for h in self.kernels) - 1, real=True)
+            k = np.arange(n_fft // 2 + 1)
+            spectra = []
+            for h in self.kernels:
+                # centre the zero-phase kernel so that all bands share one output offset
+                delay = (len(h) - 1) // 2
+                spectra.append(fft_utils.rfft(h, n_fft) * np.exp(2j * np.pi * k * delay / n_fft))
+            self._plans[n_times] = (n_edge, n_fft, np.stack(spectra).astype(self._complex_dtype))
+        return self._plans[n_times]
+
+    def transform(self, data):
+        """
+        Args:
+            data (ndarray): (..., n_times)
+        Returns:
+            filtered (ndarray): (n_bands, ..., n_times)
+        """
+        data = np.asarray(data, dtype=self.dtype)
+        n_times = data.shape[-1]
+        n_edge, n_fft, spectra = self._plan(n_times)
+        data_ext = _reflect_limited_pad(data, n_edge)
+        spectrum = fft_utils.rfft(data_ext, n_fft, axis=-1)
+        spectra = spectra.reshape((len(self.kernels),) + (1,) * (data.ndim - 1) + spectra.shape[-1:])
+        filtered = fft_utils.irfft(spectrum[None] * spectra, n_fft, axis=-1)
+        return filtered[..., n_edge:n_edge + n_times]
+
+    def _envelope_plan(self, shape):
+        """按窗长缓存 (n_edge, n_fft, spectra, work)，work 的形状与 shape 不符时重新分配"""
+        n_times = shape[-1]
+        if n_times in self._envelope_plans:
+            self._envelope_plans.move_to_end(n_times)
+        else:
+            n_edge = max(max(min(len(h), n_times) - 1, 0) for h in self.kernels)
+            n_fft = fft_utils.next_fast_len(n_times + 2 * n_edge + max(len(h) for h in self.kernels) - 1)
+            n_freqs = n_fft // 2 + 1
+            k = np.arange(n_freqs)
+            # one-sided analytic mask, negative frequencies stay zero
+            mask = fft_utils.analytic_mask(n_fft)
+            spectra = []
+            for h in self.kernels:
+                delay = (len(h) - 1) // 2
+                spectra.append(fft_utils.rfft(h, n_fft) * np.exp(2j * np.pi * k * delay / n_fft) * mask)
+            spectra = np.stack(spectra).astype(self._complex_dtype)
+            self._envelope_plans[n_times] = [n_edge, n_fft, spectra, None]
+            if len(self._envelope_plans) > self.MAX_ENVELOPE_PLANS:
+                self._envelope_plans.popitem(last=False)
+        plan = self._envelope_plans[n_times]
+        n_edge, n_fft, spectra, work = plan
+        work_shape = (len(self.kernels),) + shape[:-1] + (n_fft,)
+        if work is None or work.shape != work_shape:
+            # reusable work buffer, the negative frequency half is never written
+            work = plan[3] = np.zeros(work_shape, dtype=self._complex_dtype)
+        spectra = spectra.reshape((len(self.kernels),) + (1,) * (len(shape) - 1) + spectra.shape[-1:])
+        return n_edge, n_fft, spectra, work
+
+    def envelope(self, data):
+        """
+        带通滤波后解析信号的幅值（Hilbert 包络），所有频带只做一次 rfft 和一次 ifft
+        Args:
+            data (ndarray): (..., n_times)
+        Returns:
+            envelope (ndarray): (n_bands, ..., n_times)
+        """
+        data = np.asarray(data, dtype=self.dtype)
+        n_times = data.shape[-1]
+        n_edge, n_fft, spectra, work = self._envelope_plan(data.shape)
+        data_ext = _reflect_limited_pad(data, n_edge)
+        spectrum = fft_utils.rfft(data_ext, n_fft, axis=-1)
+        np.multiply(spectrum[None], spectra, out=work[..., :spectra.shape[-1]])
+        analytic = fft_utils.ifft(work, axis=-1)
+        return np.abs(analytic[..., n_edge:n_edge + n_times])
+
+
+def _reflect_limited_pad(data, n_pad):
+    """与 mne.filter._smart_pad(pad='reflect_limited') 相同，沿最后一维批量处理"""
+    if n_pad == 0:
+        return data
+    n_times = data.shape[-1]
+    n_reflect = min(n_pad, n_times - 1)
+    left = 2 * data[..., :1] - data[..., n_reflect:0:-1]
+    right = 2 * data[..., -1:] - data[..., -2:-n_reflect - 2:-1]
+    zeros = np.zeros(data.shape[:-1] + (n_pad - n_reflect,), dtype=left.dtype)
+    return np.concatenate((zeros, left, data, right, zeros), axis=-1)
+
+
+def _stack_bands(band_data):
+    """(n_bands, ..., n_ch, n_times) -> (..., n_bands * n_ch, n_times)，频带在前、通道在后"""
+    band_data = np.moveaxis(band_data, 0, -3)
+    return band_data.reshape(band_data.shape[:-3] + (-1, band_data.shape[-1]))
+
 
 def fast_hilbert(data):
     n_signal = data.shape[-1]
-    fft_length = fftpack.next_fast_len(n_signal)
-    pad_signal = np.zeros((*data.shape[:-1], fft_length))
-    pad_signal[..., :n_signal] = data
-    complex_signal = signal.hilbert(pad_signal, axis=-1)[..., :n_signal]
+    # 2, 3, 5 factors only, same length as the former fftpack.next_fast_len
+    fft_length = fft_utils.next_fast_len(n_signal, real=True)
+    complex_signal = fft_utils.analytic_signal(data, fft_length)[..., :n_signal]
     return complex_signal
 
 
+def _lfb_iir_params(sfreq, lfb_bands):
+    """低频带的 IIR 滤波器，与 mne.filter.filter_data(method='iir') 的默认设计相同（4 阶 butterworth，sos）"""
+    return [filter.create_filter(None, sfreq, b[0], b[1], method='iir', verbose=False) for b in lfb_bands]
+
+
 class LFPExtractor:
-    def __init__(self, sfreq, lfb_bands):
+    """
+    低频带特征，输出与 mne.filter.filter_data(method='iir', phase=phase) 一致。
+    IIR 滤波器只设计一次，sosfiltfilt（phase='forward' 时为 sosfilt）沿最后一维对所有通道、所有 epoch 一次完成，
+    mne 内部是逐行循环滤波的。
+    IIR 递推对舍入误差敏感，始终在双精度下计算，dtype 只决定输出精度。
+    phase='forward' 的因果滤波可以在线逐块计算（StreamingLFPExtractor），结果与对整段连续数据的 transform 相同。
+    """
+    def __init__(self, sfreq, lfb_bands, dtype=np.float64, phase='zero'):
+        if phase not in ('zero', 'forward'):
+            raise ValueError(f'phase must be "zero" or "forward", got {phase!r}')
+        self.sfreq = sfreq
+        self.lfb_bands = lfb_bands
+        self.dtype = dtype
+        self.phase = phase
+        self.iir_params = _lfb_iir_params(sfreq, lfb_bands)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # models pickled before the filters were cached
+        if 'iir_params' not in state:
+            self.iir_params = _lfb_iir_params(self.sfreq, self.lfb_bands)
+        self.__dict__.setdefault('dtype', np.float64)
+        self.__dict__.setdefault('phase', 'zero')
+
+    def transform(self, data):
+        """
+        data: single trial data (n_ch, n_times) or epochs (n_epochs, n_ch, n_times)
+        return: (n_bands * n_ch, n_times) or (n_epochs, n_bands * n_ch, n_times)
+        """
+        lfp_data = [self.transform_band(i, data) for i in range(len(self.iir_params))]
+        lfp_data = np.concatenate(lfp_data, axis=-2)
+        return lfp_data
+
+    def transform_band(self, i, data):
+        """
+        第 i 个频带的滤波结果 (..., n_ch, n_times)
+        """
+        iir_params = self.iir_params[i]
+        if self.phase == 'forward':
+            band_data = signal.sosfilt(iir_params['sos'], data, axis=-1)
+        else:
+            padlen = min(iir_params['padlen'], data.shape[-1] - 1)
+            band_data = signal.sosfiltfilt(iir_params['sos'], data, axis=-1, padlen=padlen)
+        return band_data.astype(self.dtype, copy=False)
+
+    def edge_samples(self, tol=1e-3):
+        """
+        窗口边缘影响特征的样本数：IIR 冲激响应衰减到峰值的 tol 以下所需的样本数（各频带中最长的），
+        零相位滤波的前向、后向两次都以此长度受边缘影响
+        """
+        impulse = np.zeros(int(10 * self.sfreq))
+        impulse[0] = 1
+        n = 0
+        for iir_params in self.iir_params:
+            h = np.abs(signal.sosfilt(iir_params['sos'], impulse))
+            n = max(n, np.flatnonzero(h > tol * h.max())[-1] + 1)
+        return int(n)
+
+
+class StreamingLFPExtractor:
+    """
+    流式低频特征提取器
+    每个频带、每个通道保存因果 SOS 滤波器的状态，每步只滤新到达的样本，
+    窗口从滑动输出缓冲区中读取，开销与步长成正比，而不是窗长。
+    滤波器与 LFPExtractor 的设计相同，输出与 LFPExtractor(phase='forward') 对整段连续数据的结果一致，
+    因此模型应使用 phase='forward' 的特征训练（FeatExtractor(lfb_phase='forward')），
+    在线时由 SlidingFeatureCache 使用。零相位（phase='zero'）的特征无法逐块计算。
+    Args:
+        sfreq: 采样率
+        lfb_bands: 频带 [(l_freq, h_freq), ...]
+        window_length (int or None): step 输出窗口的样本数，只用 filter 时可为 None
+        dtype: 输出精度，递推始终在双精度下进行
+    """
+    def __init__(self, sfreq, lfb_bands, window_length, dtype=np.float64):
         self.sfreq = sfreq
         self.lfb_bands = lfb_bands
+        self.window_length = window_length
+        self.dtype = dtype
+        self.sos = [p['sos'] for p in _lfb_iir_params(sfreq, lfb_bands)]
+        self._z = None
+        self._window = None
+
+    def reset(self):
+        self._z = None
+        self._window = None
+
+    def _filter(self, data, zi):
+        """data: (..., n_ch, n_times), zi: [(n_sections, ..., n_ch, 2)] * n_bands -> (n_bands, ..., n_ch, n_times)"""
+        out = np.empty((len(self.sos),) + data.shape)
+        zf = []
+        for i, (sos, z) in enumerate(zip(self.sos, zi)):
+            out[i], z = signal.sosfilt(sos, data, axis=-1, zi=z)
+            zf.append(z)
+        return out, zf
+
+    def _zeros(self, shape):
+        return [np.zeros((len(sos),) + shape + (2,)) for sos in self.sos]
+
+    def step(self, data):
+        """
+        输入新到达的样本，返回最新的特征窗口
+        Args:
+            data (ndarray): (n_ch, n_new) 新样本
+        Returns:
+            window (ndarray): (n_bands * n_ch, window_length) 视图，下一次 step 前有效；
+                开始阶段数据不足 window_length 时左侧为 0
+        """
+        band_data = self.filter(data)
+        if self._window is None:
+            self._window = RollingWindow(band_data.shape[0], self.window_length, dtype=self.dtype)
+        self._window.append(band_data)
+        return self._window.window()
+
+    def filter(self, data):
+        """
+        只做有状态的因果滤波，不写入输出窗口（例如 OnlineFilterChain 的带通频带）
+        Args:
+            data (ndarray): (n_ch, n_new) 新样本
+        Returns:
+            band_data (ndarray): (n_bands * n_ch, n_new)
+        """
+        if self._z is None:
+            self._z = self._zeros(data.shape[:-1])
+        band_data, self._z = self._filter(data, self._z)
+        return band_data.reshape((-1, data.shape[-1])).astype(self.dtype, copy=False)
 
     def transform(self, data):
         """
-        data: single trial data (n_ch, n_times)
+        离线提取与 step 相同的因果滤波特征
+        data: (n_ch, n_times) 或 (n_epochs, n_ch, n_times)
+        return: (n_bands * n_ch, n_times) 或 (n_epochs, n_bands * n_ch, n_times)
         """
-        lfp_data = []
-        for b in self.lfb_bands:
-            band_data = filter.filter_data(data, self.sfreq, b[0], b[1], method='iir', phase='zero', verbose=False)
-            lfp_data.append(band_data)
-        lfp_data = np.concatenate(lfp_data, axis=0)
-        return lfp_data
\ No newline at end of file
+        band_data, _ = self._filter(data, self._zeros(data.shape[:-1]))
+        return _stack_bands(band_data).astype(self.dtype, copy=False)
+
@@ -0,0 +1,80 @@
+"""
+bci_core 共用的 FFT 工具
+统一使用 scipy.fft（pocketfft），线程数由 set_workers 全局设置，最优 FFT 长度按参数缓存。
+
+scipy.fft 没有 out 参数，变换结果总是新数组；预分配的缓冲区只用在频域乘法上（np.multiply(out=)），
+见 analytic_signal 与 FIRFilterBank.envelope。
+FeatExtractor(n_workers>1) 的线程池与这里的 workers 会叠加，两者不宜同时设得很大。
+"""
+from functools import lru_cache
+
+import numpy as np
+from scipy import fft as _fft
+
+
+_workers = 1
+
+
+def set_workers(workers):
+    """
+    设置 FFT 使用的线程数
+    :param workers: int，-1 表示使用全部 CPU
+    """
+    global _workers
+    _workers = workers
+
+
+def get_workers():
+    return _workers
+
+
+@lru_cache(maxsize=256)
+def next_fast_len(n, real=False):
+    """
+    scipy.fft.next_fast_len 的缓存版本
+    real=True 时只使用 2, 3, 5 的因子，与 scipy.fftpack.next_fast_len 相同
+    """
+    return _fft.next_fast_len(n, real=real)
+
+
+def rfft(x, n=None, axis=-1):
+    return _fft.rfft(x, n, axis=axis, workers=_workers)
+
+
+def irfft(x, n=None, axis=-1):
+    return _fft.irfft(x, n, axis=axis, workers=_workers)
+
+
+def fft(x, n=None, axis=-1):
+    return _fft.fft(x, n, axis=axis, workers=_workers)
+
+
+def ifft(x, n=None, axis=-1):
+    return _fft.ifft(x, n, axis=axis, workers=_workers)
+
+
+def analytic_mask(n_fft):
+    """
+    解析信号在 rfft 频点上的权重 (n_fft // 2 + 1,)：直流和 Nyquist 为 1，其余正频率为 2，
+    与 scipy.signal.hilbert 相同，负频率部分为 0
+    """
+    mask = np.full(n_fft // 2 + 1, 2.)
+    mask[0] = 1.
+    if n_fft % 2 == 0:
+        mask[-1] = 1.
+    return mask
+
+
+def analytic_signal(x, n_fft, out=None):
+    """
+    沿最后一维的解析信号，结果与 scipy.signal.hilbert(x, n_fft) 相同，但只做一次 rfft
+        x: ndarray (..., n_times)，实数
+        n_fft: FFT 长度
+        out: 可选的预分配工作区，complex (..., n_fft)，负频率部分必须为 0
+    return: complex (..., n_fft)
+    """
+    n_freqs = n_fft // 2 + 1
+    if out is None:
+        out = np.zeros(x.shape[:-1] + (n_fft,), dtype=np.result_type(x.dtype, np.complex64))
+    np.multiply(rfft(x, n_fft), analytic_mask(n_fft), out=out[..., :n_freqs])
+    return ifft(out)
@@ -1,45 +1,98 @@
 import numpy as np
 
 from scipy import signal
+from scipy.linalg import block_diag
+from scipy.special import expit, softmax
 from pyriemann.estimation import BlockCovariances
 from pyriemann.tangentspace import TangentSpace
 from pyriemann.preprocessing import Whitening
+from pyriemann.utils.base import invsqrtm
 from sklearn.pipeline import make_pipeline
 from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.linear_model import LogisticRegression
 from mne.decoding import Vectorizer, CSP
 
+from . import resample
+from .utils import RollingWindow
+
 
 class DecimateFeature(BaseEstimator, TransformerMixin):
     """DecimateFeature 类用于对信号进行降采样以达到目标采样频率。"""
-    def __init__(self, fs, target_fs=10, axis=-1):
-        """初始化函数，设置原始采样频率 fs，目标采样频率 target_fs，以及降采样操作的轴 axis。"""
+    def __init__(self, fs, target_fs=10, axis=-1, dtype=None, method='poly'):
+        """
+        初始化函数，设置原始采样频率 fs，目标采样频率 target_fs，以及降采样操作的轴 axis。
+        dtype 为输出精度，None 时 'poly' 与输入相同，'iir' 与 scipy 的计算结果一致（float64）。
+        method:
+            'poly': 一次多相 FIR 抗混叠降采样（resample.resample_poly），支持任意整数或有理数倍率，
+                边缘按直线外推，精度与输入相同；在线窗口可用 resample.StreamingResampler 逐块计算
+            'iir': 原来的做法，两次 sqrt(fs / target_fs) 倍的零相位 IIR decimate，只在倍率为完全平方数时准确，
+                始终在双精度下计算；之前保存的模型沿用这种方式
+        """
         self.fs = fs
         self.target_fs = target_fs
         self.axis = axis
+        self.dtype = dtype
+        self.method = method
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.__dict__.setdefault('dtype', None)
+        # models pickled before the polyphase engine keep their features unchanged
+        self.__dict__.setdefault('method', 'iir')
 
     def fit(self, X, y=None):
         return self
     
     def transform(self, X, y=None):
         """
-        对输入数据 X 进行两次降采样操作，以达到目标采样频率。
-        使用 scipy.signal.decimate 方法进行降采样，采用零相位滤波以减少延迟。
+        对输入数据 X 降采样到目标采样频率，方式见 method。
+        特征提取阶段已降采样（fs == target_fs）时不做任何处理。
         """
+        if self.fs == self.target_fs:
+            return X if self.dtype is None else X.astype(self.dtype, copy=False)
+        if self.method == 'poly':
+            up, down = resample.poly_ratio(self.fs, self.target_fs)
+            if self.dtype is not None:
+                X = X.astype(self.dtype, copy=False)
+            return resample.resample_poly(X, up, down, axis=self.axis)
+        if self.method != 'iir':
+            raise ValueError(f'unknown decimation method {self.method}')
         decimate_rate = np.sqrt(self.fs / self.target_fs).astype(np.int16)
         X = signal.decimate(X, decimate_rate, axis=self.axis, zero_phase=True)
         # to 10Hz
         X = signal.decimate(X, decimate_rate, axis=self.axis, zero_phase=True)
+        if self.dtype is not None:
+            X = X.astype(self.dtype, copy=False)
         return X
 
 
 class ChannelScaler(BaseEstimator, TransformerMixin):
     """
     ChannelScaler 类用于对信号的每个通道进行标准化处理。
+    均值和标准差始终以双精度统计；dtype 为输出精度，None 时与输入相同。
+    协方差、切空间等步骤之前应设为 np.float64。
+    标准化预先合并为 X * scale_ + offset_（scale_ = 1 / std，offset_ = -mean / std），
+    transform 只在一个缓冲区上做一次乘法和一次加法：
+    copy=False 且精度一致时直接在输入上修改，也可以通过 transform(X, out=buf) 复用缓冲区。
     """
-    def __init__(self, norm_axis=(0, 2)):
+    def __init__(self, norm_axis=(0, 2), dtype=None, copy=True):
         self.channel_mean_ = None
         self.channel_std_ = None
         self.norm_axis=norm_axis
+        self.dtype = dtype
+        self.copy = copy
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.__dict__.setdefault('dtype', None)
+        self.__dict__.setdefault('copy', True)
+        if 'scale_' not in self.__dict__ and self.channel_std_ is not None:
+            # pickled before scale_ / offset_ were introduced
+            self._fold()
+
+    def _fold(self):
+        self.scale_ = 1. / self.channel_std_
+        self.offset_ = -self.channel_mean_ * self.scale_
 
     def fit(self, X, y=None):
         '''
@@ -48,15 +101,264 @@ class ChannelScaler(BaseEstimator, TransformerMixin):
         :param y:
         :return:
         '''
-        self.channel_mean_ = np.mean(X, axis=self.norm_axis, keepdims=True)
-        self.channel_std_ = np.std(X, axis=self.norm_axis, keepdims=True)
+        self.channel_mean_ = np.mean(X, axis=self.norm_axis, keepdims=True, dtype=np.float64)
+        self.channel_std_ = np.std(X, axis=self.norm_axis, keepdims=True, dtype=np.float64)
+        self._fold()
         return self
 
-    def transform(self, X, y=None):
-        X = X.copy()
-        X -= self.channel_mean_
-        X /= self.channel_std_
-        return X
+    def transform(self, X, y=None, out=None):
+        """
+        :param X: 3d array with shape (n_epochs, n_channels, n_times)
+        :param out: 可选的输出缓冲区，形状与 X 相同，精度为输出精度
+        :return: 标准化后的数组（out 给定时即为 out）
+        """
+        dtype = X.dtype if self.dtype is None else np.dtype(self.dtype)
+        if out is None:
+            if self.copy or X.dtype != dtype or not X.flags.writeable:
+                out = np.empty(X.shape, dtype=dtype)
+            else:
+                out = X
+        np.multiply(X, self.scale_.astype(dtype, copy=False), out=out, casting='same_kind')
+        out += self.offset_.astype(dtype, copy=False)
+        return out
+
+
+class SlidingBlockCovariances:
+    """
+    滑动窗口的块协方差（Ledoit-Wolf 收缩），与 BlockCovariances(estimator='lwf') 对同一窗口的结果一致。
+    每个块维护窗口内的 Σx, Σxxᵀ, Σ||x||²x, Σ||x||⁴，样本移入、移出都是秩更新，
+    收缩系数由这些累加量解析计算，每步开销 O(hop × dim²)，与窗长无关。
+    每累计更新 window_length 个样本后从窗口数据重新求和一次，避免舍入误差累积。
+    Args:
+        block_size (list of int): 各块的维数，与 BlockCovariances 相同
+        window_length (int): 窗口样本数
+    """
+    def __init__(self, block_size, window_length):
+        self.block_size = list(block_size)
+        self.window_length = window_length
+        self._bounds = np.cumsum([0] + self.block_size)
+        self._window = RollingWindow(self._bounds[-1], window_length)
+        self.reset()
+
+    def reset(self):
+        self._window.reset()
+        self._sums = [[0., np.zeros(d), np.zeros((d, d)), np.zeros(d), 0.] for d in self.block_size]
+        self._n_updated = 0
+
+    @property
+    def n_samples(self):
+        return self._window.n_filled
+
+    def _accumulate(self, X, sign):
+        for (lo, hi), sums in zip(zip(self._bounds[:-1], self._bounds[1:]), self._sums):
+            x = X[lo:hi]
+            sq = np.einsum('ij,ij->j', x, x)
+            sums[0] += sign * x.shape[1]
+            sums[1] += sign * x.sum(axis=1)
+            sums[2] += sign * (x @ x.T)
+            sums[3] += sign * (x @ sq)
+            sums[4] += sign * (sq @ sq)
+
+    def update(self, X, n_replace=0):
+        """
+        Args:
+            X (ndarray): (n_features, n_new) 新样本
+            n_replace (int): X 的前 n_replace 列替换窗口中最近的 n_replace 个样本（重新计算过的特征），
+                其余列追加到窗口末尾，超出窗长的最早样本移出
+        """
+        n_replace = min(n_replace, self.n_samples)
+        if n_replace > 0:
+            self._accumulate(self._window.window(n_replace), -1)
+            self._window.rewind(n_replace)
+        n_drop = max(self.n_samples + X.shape[1] - self.window_length, 0)
+        if n_drop > 0:
+            self._accumulate(self._window.window(self.n_samples)[:, :n_drop], -1)
+        self._window.append(X)
+        self._n_updated += X.shape[1]
+        if self._n_updated >= self.window_length:
+            self._refresh()
+        else:
+            self._accumulate(X[:, -self.window_length:], 1)
+
+    def _refresh(self):
+        self._sums = [[0., np.zeros(d), np.zeros((d, d)), np.zeros(d), 0.] for d in self.block_size]
+        self._accumulate(self._window.window(self.n_samples), 1)
+        self._n_updated = 0
+
+    def covariance(self):
+        """
+        Returns:
+            cov (ndarray): (n_features, n_features) 块对角协方差
+        """
+        blocks = []
+        for n, s1, s2, s3, s4 in self._sums:
+            mean = s1 / n
+            cov = s2 / n - np.outer(mean, mean)
+            # sum of the 4th power of the centred sample norms, expanded in terms of the running sums
+            c = mean @ mean
+            sum_norm4 = s4 - 4 * mean @ s3 + 4 * mean @ s2 @ mean + 2 * c * np.trace(s2) - 3 * n * c ** 2
+            blocks.append(_shrink_ledoit_wolf(cov, sum_norm4, n))
+        return block_diag(*blocks)
+
+
+def _shrink_ledoit_wolf(cov, sum_norm4, n):
+    """
+    Ledoit-Wolf 收缩，与 sklearn.covariance.ledoit_wolf 相同（样本已中心化）
+        cov: (..., d, d) 经验协方差
+        sum_norm4: (...,) 各样本范数四次方之和 Σ||x||⁴
+        n: 样本数
+    return: (..., d, d)
+    """
+    d = cov.shape[-1]
+    if d == 1:
+        return cov
+    trace = np.trace(cov, axis1=-2, axis2=-1)
+    mu = trace / d
+    delta_ = np.sum(cov ** 2, axis=(-2, -1))
+    beta = (sum_norm4 / n - delta_) / (d * n)
+    delta = (delta_ - 2 * mu * trace + d * mu ** 2) / d
+    beta = np.minimum(beta, delta)
+    shrinkage = np.divide(beta, delta, out=np.zeros_like(beta, dtype=float), where=beta != 0)
+    shrinkage = np.asarray(shrinkage)[..., None, None]
+    return (1 - shrinkage) * cov + shrinkage * np.asarray(mu)[..., None, None] * np.eye(d)
+
+
+def block_covariances_lwf(X, block_size):
+    """
+    批量计算块对角 Ledoit-Wolf 协方差，与 BlockCovariances(block_size, estimator='lwf') 一致
+        X: (n_matrices, n_channels, n_times)
+        block_size: list of int
+    return: (n_matrices, n_channels, n_channels)
+    """
+    n_times = X.shape[-1]
+    covmats = np.zeros(X.shape[:-1] + (X.shape[-2],))
+    start = 0
+    for d in block_size:
+        x = X[:, start:start + d]
+        x = x - x.mean(axis=-1, keepdims=True)
+        cov = x @ x.transpose(0, 2, 1) / n_times
+        sq_norm = np.einsum('nij,nij->nj', x, x)
+        covmats[:, start:start + d, start:start + d] = _shrink_ledoit_wolf(cov, np.sum(sq_norm ** 2, axis=-1), n_times)
+        start += d
+    return covmats
+
+
+class CompiledRiemannEmbedder:
+    """
+    训练好的 riemann_feature_embedder 的推理版本（见 pipeline.export_for_inference）
+    标准化的方差、白化滤波器和切空间参考点 C_ref^{-1/2} 预先合并：
+    每个窗口只需逐通道缩放、块协方差、一次合同变换 PᵀCP、一次批量 eigh 求 logm 和取上三角，
+    不经过 sklearn Pipeline 和 pyriemann 的检查，结果与原管道一致。
+    标准化的均值在协方差估计中心化时被消去，不需要计算。
+    Args:
+        embedder: 训练好的 riemann_feature_embedder 管道
+    """
+    def __init__(self, embedder):
+        steps = embedder.named_steps
+        scaler, covariances = steps['channelscaler'], steps['blockcovariances']
+        whitening, tangent_space = steps['whitening'], steps['tangentspace']
+        if covariances.estimator != 'lwf':
+            raise ValueError(f'only the "lwf" estimator can be compiled, got {covariances.estimator}')
+        if tangent_space.metric != 'riemann' or tangent_space.tsupdate:
+            raise ValueError('only the riemann metric with a fixed reference can be compiled')
+        self.inv_std = scaler.scale_.reshape((-1, 1))
+        n_channels = len(self.inv_std)
+        block_size = covariances.block_size
+        if isinstance(block_size, int):
+            block_size = [block_size] * (n_channels // block_size)
+        self.block_size = list(block_size)
+        # whitening followed by the tangent space reference, one congruence
+        self.congruence = whitening.filters_ @ invsqrtm(tangent_space.reference_)
+        n = self.congruence.shape[1]
+        self._triu = np.triu_indices(n)
+        self._coeffs = (np.sqrt(2) * np.triu(np.ones((n, n)), 1) + np.eye(n))[self._triu]
+
+    def transform(self, X):
+        """
+        Args:
+            X (ndarray): (n_windows, n_channels, n_times)
+        Returns:
+            T (ndarray): (n_windows, n_ts) 切空间向量
+        """
+        covmats = block_covariances_lwf(X * self.inv_std, self.block_size)
+        covmats = self.congruence.T @ covmats @ self.congruence
+        eigvals, eigvecs = np.linalg.eigh(covmats)
+        logm = (eigvecs * np.log(eigvals)[:, None, :]) @ eigvecs.transpose(0, 2, 1)
+        return self._coeffs * logm[:, self._triu[0], self._triu[1]]
+
+
+class CompiledLinearClassifier:
+    """
+    训练好的 LogisticRegression 的推理版本，只保留 coef_、intercept_ 和 classes_，
+    predict_proba 与 sklearn 的计算方式相同（二分类/ovr 为 sigmoid，multinomial 为 softmax）
+    coef 和 intercept 可以替换为前面的仿射步骤合并后的结果（见 pipeline.fuse_affine_steps），
+    此时输入可以是多维的特征，按 C 顺序展平后与 coef 相乘（连续数组展平不拷贝）。
+    """
+    def __init__(self, clf, coef=None, intercept=None):
+        if not isinstance(clf, LogisticRegression):
+            raise ValueError(f'only LogisticRegression can be compiled, got {type(clf).__name__}')
+        self.coef_ = clf.coef_ if coef is None else coef
+        self.intercept_ = clf.intercept_ if intercept is None else intercept
+        self.classes_ = clf.classes_
+        self.ovr = clf.multi_class in ['ovr', 'warn'] or (
+            clf.multi_class == 'auto' and (len(clf.classes_) <= 2 or clf.solver in ('liblinear', 'newton-cholesky')))
+
+    def decision_function(self, X):
+        decision = X.reshape((len(X), -1)) @ self.coef_.T + self.intercept_
+        return decision.ravel() if decision.shape[1] == 1 else decision
+
+    def predict_proba(self, X):
+        decision = self.decision_function(X)
+        if self.ovr:
+            prob = expit(decision)
+            if prob.ndim == 1:
+                return np.vstack([1 - prob, prob]).T
+            return prob / prob.sum(axis=1, keepdims=True)
+        if decision.ndim == 1:
+            decision = np.c_[-decision, decision]
+        return softmax(decision, axis=1)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class OnlineRiemannEmbedder:
+    """
+    已训练的 riemann_feature_embedder 的在线版本
+    协方差由 SlidingBlockCovariances 随特征窗口滑动增量更新，白化和切空间映射沿用训练好的步骤，
+    与对整窗调用 embedder.transform 的结果一致。
+    Args:
+        embedder: 训练好的 riemann_feature_embedder 管道
+        window_length (int): 特征窗口样本数
+    """
+    def __init__(self, embedder, window_length):
+        steps = dict(embedder.named_steps)
+        covariances = steps.get('blockcovariances')
+        if covariances is None or covariances.estimator != 'lwf':
+            raise ValueError('OnlineRiemannEmbedder requires a riemann_feature_embedder with estimator="lwf"')
+        self.scaler = steps['channelscaler']
+        self.tangent_steps = embedder[2:]
+        self.covariances = SlidingBlockCovariances(covariances.block_size, window_length)
+
+    def reset(self):
+        self.covariances.reset()
+
+    def step(self, features, n_new=None, n_update=None):
+        """
+        Args:
+            features (ndarray): (n_features, n_times) 当前特征窗口
+            n_new (int or None): 新样本数，None 表示与上一步不连续，整窗重新计算
+            n_update (int or None): 窗口末尾重新计算过的样本数（>= n_new），见 SlidingFeatureCache
+        Returns:
+            X_embed (ndarray): (1, n_embed)
+        """
+        if n_new is None or self.covariances.n_samples == 0:
+            self.covariances.reset()
+            self.covariances.update(self.scaler.transform(features[None])[0])
+        elif n_update > 0:
+            X = self.scaler.transform(features[None, :, -n_update:])[0]
+            self.covariances.update(X, n_replace=n_update - n_new)
+        return self.tangent_steps.transform(self.covariances.covariance()[None])
 
 
 def riemann_feature_embedder(feat_dim, estimator='lwf'):
@@ -65,31 +367,32 @@ def riemann_feature_embedder(feat_dim, estimator='lwf'):
 
     参数 feat_dim 定义每个数据块的大小，estimator 选择协方差矩阵的估计方法。
     管道包括通道标准化、块协方差矩阵计算、白化处理以及切换到切线空间的步骤。
+    协方差及之后的步骤在双精度下计算，单精度的特征在标准化时转为 float64。
     """
     return make_pipeline(
-        ChannelScaler(),  # not necessary
+        ChannelScaler(dtype=np.float64),  # not necessary
         BlockCovariances(block_size=feat_dim, estimator=estimator),
         Whitening(metric='riemann', dim_red={'expl_var': 0.99}),
         TangentSpace()
     )
 
 
-def baseline_feature_embedder(fs, target_fs, axis):
+def baseline_feature_embedder(fs, target_fs, axis, dtype=None):
     """
     创建一个基线特征嵌入管道，主要用于降采样和通道标准化。
 
-    参数 fs, target_fs, axis 分别为原始采样频率、目标采样频率和降采样操作的轴。
+    参数 fs, target_fs, axis 分别为原始采样频率、目标采样频率和降采样操作的轴，dtype 为降采样后的特征精度。
     管道包括降采样、通道标准化和向量化处理的步骤。
     """
     return make_pipeline(
-        DecimateFeature(fs, target_fs, axis),
-        ChannelScaler(),
+        DecimateFeature(fs, target_fs, axis, dtype=dtype),
+        ChannelScaler(dtype=dtype),
         Vectorizer()
     )
 
 
 def cps_feature_embedder(n_chs):
     return make_pipeline(
-        ChannelScaler(),
+        ChannelScaler(dtype=np.float64),
         CSP(n_chs, reg='ledoit_wolf', log=True)
     )
@@ -5,7 +5,9 @@ import logging
 import os
 from scipy import signal
 from .utils import parse_model_type, reref
-from .pipeline import data_evaluation
+from .pipeline import data_evaluation, export_for_inference
+from .model import OnlineRiemannEmbedder
+from .feature_extractors import FeatExtractor, StreamingLFPExtractor
 
 
 logger = logging.getLogger(__name__)
@@ -47,6 +49,9 @@ class Controller:
             fs, data = self.parse_data(data)
             p = self.real_feedback_model.step_probability(fs, data)
             logger.debug('step_decison: model probability: {}'.format(str(p)))
+            if not np.all(np.isfinite(p)):
+                # the window overlaps a data gap
+                return -1
             pred = np.argmax(p)
             real_decision = self.real_feedback_model.model.classes_[pred]
             return real_decision
@@ -165,6 +170,10 @@ class HMMModel:
             return self.update_state(p)
     
     def update_state(self, current_p):
+        if not np.all(np.isfinite(current_p)):
+            # e.g. the window overlaps samples lost during reconnection (NaN), keep the state
+            logger.warning('non-finite emission probability, state is not updated')
+            return -1
         # veterbi algorithm
         prob = (self.state_trans_matrix * self._probability.T).sum(axis=1) * current_p
         # normalize
@@ -193,22 +202,186 @@ class ClfEmissionHMM(HMMModel):
     """
     ClfEmissionHMM 则是 HMMModel 的一个扩展，结合了分类模型的输出作为HMM的发射概率。
     """
-    def __init__(self, model, **kwargs):
+    def __init__(self, model, use_feature_cache=False, cache_margin=None, cache_context=None,
+                 use_online_covariance=False, compile_model=False, **kwargs):
         """
         初始化分类器发射的HMM模型。
             model: 包含特征提取器、嵌入器和分类模型的元组或模型文件路径。
+            use_feature_cache: 为 True 时相邻决策窗口重叠部分的特征不再重复计算（SlidingFeatureCache），
+                只计算新到达的样本，边缘附近的特征与整窗计算略有差异。
+                FeatExtractor 的模型需以 lfb_phase='forward' 训练，低频带特征随数据到达逐块滤波。
+            cache_margin, cache_context: 见 SlidingFeatureCache，单位秒，None 时由特征提取器的滤波器长度确定
+            use_online_covariance: 与 use_feature_cache 同时使用，riemann 模型的块协方差随窗口滑动增量更新
+                （OnlineRiemannEmbedder），每步只加入缓存给出的新样本和重新计算的样本（last_update），
+                不再对整窗重新计算；缓存整窗重新计算时（数据不连续）协方差随之重置
+            compile_model: 使用 export_for_inference 转换后的推理版本模型，与 use_online_covariance 互斥
         """
         if isinstance(model, str):
             model = joblib.load(model)
+        if compile_model:
+            if use_online_covariance:
+                raise ValueError('compile_model and use_online_covariance can not be used together')
+            model = export_for_inference(model)
         self.feat_extractor, self.embedder, self.model = model
+        if use_feature_cache:
+            self.feature_cache = SlidingFeatureCache(self.feat_extractor, cache_margin, cache_context)
+        else:
+            self.feature_cache = None
+        self.online_embedder = None
+        if use_online_covariance:
+            if not use_feature_cache:
+                raise ValueError('use_online_covariance requires use_feature_cache')
+            # window length is known at the first step
+            self._online_covariance = True
+        else:
+            self._online_covariance = False
 
         super(ClfEmissionHMM, self).__init__(n_classes=len(self.model.classes_), **kwargs)
     
     def step_probability(self, fs, data):
-        p = data_evaluation([self.feat_extractor, self.embedder, self.model], data, fs, None, None, False).squeeze()
+        if not np.all(np.isfinite(data)):
+            # samples lost during reconnection are NaN, no emission for this window
+            return np.full(len(self.model.classes_), np.nan)
+        if self.feature_cache is None:
+            p = data_evaluation([self.feat_extractor, self.embedder, self.model], data, fs, None, None, False).squeeze()
+        elif self._online_covariance:
+            features = self.feature_cache.transform(fs, data)
+            if self.online_embedder is None or self.online_embedder.covariances.window_length != features.shape[-1]:
+                self.online_embedder = OnlineRiemannEmbedder(self.embedder, features.shape[-1])
+            n_new, n_update = self.feature_cache.last_update
+            X_embed = self.online_embedder.step(features, n_new, n_update)
+            p = self.model.predict_proba(X_embed).squeeze()
+        else:
+            X = self.feature_cache.transform(fs, data)[None]
+            p = self.model.predict_proba(self.embedder.transform(X)).squeeze()
         return p
 
 
+class SlidingFeatureCache:
+    """
+    重叠决策窗口的特征缓存
+    在线决策窗口（如 1s）每步只前进约 100ms，缓存上一窗口的特征，
+    通过与上一窗口数据的重叠自动识别新到达的样本数，只对新样本计算特征：
+    FeatExtractor(lfb_phase='forward') 的低频带特征由 StreamingLFPExtractor 保存因果滤波的状态逐块计算，
+    与对连续数据离线提取的特征一致；
+    其余特征（小波功率、FIR 包络）对新样本左侧多取 context 秒数据参与滤波（结果丢弃），
+    上一窗口右端 margin 秒内受边缘效应影响的特征一并重新计算。
+    数据不连续（窗长改变、重叠部分不一致）时整窗重新计算，低频带的滤波状态从零开始。
+    特征提取器需输出与输入等长的特征 (n_feat, n_times)，降采样输出的提取器每次整窗计算。
+    margin 和 context 默认由逐窗口计算部分的 edge_samples 给出（小波、FIR 核的半长），
+    新样本加两者超过窗长时整窗计算。零相位的低频带特征（lfb_phase='zero'）边缘影响约 0.45s，
+    1s 的窗口无法增量计算，此时必须显式给出 margin 和 context（边缘附近的特征有误差），否则抛出 ValueError。
+    Args:
+        feat_extractor: FeatExtractor 或 FilterbankExtractor
+        margin (float or None): 秒，应不短于滤波器（小波）边缘影响的长度，None 时由 edge_samples 确定
+        context (float or None): 秒，同上
+    """
+    def __init__(self, feat_extractor, margin=None, context=None):
+        self.feat_extractor = feat_extractor
+        self.margin = margin
+        self.context = context
+        # rows recomputed around the new samples, and causal low frequency rows streamed in front of them
+        self._windowed, self._streamed = feat_extractor, None
+        if isinstance(feat_extractor, FeatExtractor) and feat_extractor.use_lfb and feat_extractor.target_fs is None:
+            if feat_extractor.lfb_extractor.phase == 'forward':
+                self._streamed = feat_extractor.lfb_extractor
+                self._windowed = feat_extractor.hgs_extractor if feat_extractor.use_hgb else None
+            elif margin is None or context is None:
+                raise ValueError('zero-phase low frequency features can not be cached, '
+                                 'train the model with lfb_phase="forward" or give margin and context')
+        if (margin is None or context is None) and self._windowed is not None \
+                and not hasattr(self._windowed, 'edge_samples'):
+            raise ValueError(f'margin and context must be given for {type(feat_extractor).__name__}')
+        self.reset()
+
+    def _edge(self, fs):
+        """(margin, context) 的样本数"""
+        if self._windowed is None:
+            return 0, 0
+        n_edge = self._windowed.edge_samples() if self.margin is None or self.context is None else 0
+        margin = n_edge if self.margin is None else int(self.margin * fs)
+        context = n_edge if self.context is None else int(self.context * fs)
+        return margin, context
+
+    def reset(self):
+        self._data = None
+        self._features = None
+        self._lfp_stream = None
+        # number of steps served incrementally
+        self.n_incremental = 0
+        # (n_new, n_update) of the last transform: new samples and recomputed samples at the end of the window,
+        # (None, None) if the whole window was recomputed
+        self.last_update = (None, None)
+
+    def _n_new(self, data):
+        """与上一窗口对比得到新样本数，不连续时返回 None"""
+        prev = self._data
+        if prev is None or prev.shape != data.shape:
+            return None
+        n_times = data.shape[-1]
+        # candidate shifts: where the last previous sample reappears
+        match = np.flatnonzero(np.all(data == prev[:, -1:], axis=0))
+        for j in match[::-1]:
+            n_new = n_times - 1 - j
+            if np.array_equal(data[:, :n_times - n_new], prev[:, n_new:]):
+                return n_new
+        return None
+
+    def transform(self, fs, data):
+        """
+        Args:
+            fs: 采样率
+            data (ndarray): (n_ch, n_times) 当前决策窗口
+        Returns:
+            features (ndarray): (n_feat, n_times)
+        """
+        n_times = data.shape[-1]
+        margin, context = self._edge(fs)
+        n_new = self._n_new(data)
+        if n_new == 0:
+            self.last_update = (0, 0)
+            return self._features
+        incremental = n_new is not None and n_new + margin + context <= n_times
+        parts = []
+        if self._streamed is not None:
+            parts.append(self._stream(data, n_new))
+        if self._windowed is not None:
+            if incremental:
+                n_update = n_new + margin
+                new_features = self._windowed.transform(data[:, n_times - n_update - context:])
+                # the windowed rows come last
+                prev = self._features[self._features.shape[0] - new_features.shape[0]:]
+                windowed = np.empty_like(prev)
+                windowed[:, :n_times - n_update] = prev[:, n_new:n_times - margin]
+                windowed[:, n_times - n_update:] = new_features[:, context:]
+            else:
+                windowed = self._windowed.transform(data)
+            parts.append(windowed)
+        # the streamed window is a view into the rolling buffer, always copied here
+        features = np.concatenate(parts, axis=0)
+        if incremental:
+            self.n_incremental += 1
+            self.last_update = (n_new, n_new + margin)
+        else:
+            self.last_update = (None, None)
+            if features.shape[-1] != n_times:
+                # decimated features can not be spliced by samples
+                self._data = None
+                return features
+        self._data = data.copy()
+        self._features = features
+        return features
+
+    def _stream(self, data, n_new):
+        """因果低频带特征的当前窗口，数据不连续时滤波状态从零开始"""
+        n_times = data.shape[-1]
+        if n_new is None or self._lfp_stream is None or self._lfp_stream.window_length != n_times:
+            lfb = self._streamed
+            self._lfp_stream = StreamingLFPExtractor(lfb.sfreq, lfb.lfb_bands, n_times, dtype=lfb.dtype)
+            return self._lfp_stream.step(data)
+        return self._lfp_stream.step(data[:, n_times - n_new:])
+
+
 def model_loader(model_path, **kwargs):
     """
     模型如果存在训练好的transmat，会直接load
@@ -1,18 +1,30 @@
 import numpy as np
 
+from mne.decoding import Vectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import FunctionTransformer
+
 from .model import riemann_feature_embedder, baseline_feature_embedder, cps_feature_embedder
+from .model import CompiledRiemannEmbedder, CompiledLinearClassifier, ChannelScaler
 from .feature_extractors import FeatExtractor, FilterbankExtractor
 from .utils import cut_epochs
 
 
-def csp_model_builder(fs, n_components=8, lf_bands=[(15, 35), (35, 50)], hg_bands=[(55, 95), (105, 145)]):
-    feat_extractor = FeatExtractor(fs, lf_bands, hg_bands)
+def csp_model_builder(fs, n_components=8, lf_bands=[(15, 35), (35, 50)], hg_bands=[(55, 95), (105, 145)],
+                      dtype=np.float64, lfb_phase='zero'):
+    feat_extractor = FeatExtractor(fs, lf_bands, hg_bands, dtype=dtype, lfb_phase=lfb_phase)
     embedder = cps_feature_embedder(n_components)
     return [feat_extractor, embedder]
 
 
-def riemann_model_builder(fs, n_ch=8, lf_bands=[(15, 35), (35, 50)], hg_bands=[(55, 95), (105, 145)]):
-    feat_extractor = FeatExtractor(fs, lf_bands, hg_bands)
+def riemann_model_builder(fs, n_ch=8, lf_bands=[(15, 35), (35, 50)], hg_bands=[(55, 95), (105, 145)],
+                          dtype=np.float64, lfb_phase='zero'):
+    """
+    lfb_phase: 低频带滤波的相位，'forward'（因果）的模型在线时可用 ClfEmissionHMM(use_feature_cache=True)
+        逐块计算特征，见 FeatExtractor
+    """
+    feat_extractor = FeatExtractor(fs, lf_bands, hg_bands, dtype=dtype, lfb_phase=lfb_phase)
     # compute covariance
     feat_dim = []
     if lf_bands is not None:
@@ -23,18 +35,87 @@ def riemann_model_builder(fs, n_ch=8, lf_bands=[(15, 35), (35, 50)], hg_bands=[(
     return [feat_extractor, embedder]
 
 
-def baseline_model_builder(fs, freqs=(20, 150, 15), target_fs=10):
+def baseline_model_builder(fs, freqs=(20, 150, 15), target_fs=10, dtype=None, decimate_early=False):
+    """
+    decimate_early: 小波功率在特征提取阶段直接降采样到 target_fs（一次多相滤波），
+        DecimateFeature 不再处理，中间数组缩小 fs / target_fs 倍
+    """
     filter_banks = np.arange(*freqs)
-    feat_extractor = FilterbankExtractor(fs, filter_banks)
-    embedder = baseline_feature_embedder(fs, target_fs, axis=-1)
+    if decimate_early:
+        feat_extractor = FilterbankExtractor(fs, filter_banks, target_fs=target_fs)
+        embedder = baseline_feature_embedder(target_fs, target_fs, axis=-1, dtype=dtype)
+    else:
+        feat_extractor = FilterbankExtractor(fs, filter_banks)
+        embedder = baseline_feature_embedder(fs, target_fs, axis=-1, dtype=dtype)
     return [feat_extractor, embedder]
 
 
-def data_evaluation(model, raw: np.ndarray, fs, events=None, duration=None, return_cls=True):
+def export_for_inference(model):
+    """
+    将训练好的模型转换为推理版本，预先合并各步骤的常量，输出概率与原模型相同
+    riemann 模型的嵌入器转为 CompiledRiemannEmbedder，LogisticRegression 转为 CompiledLinearClassifier；
+    其他嵌入器末尾的仿射步骤（如 baseline 模型的 ChannelScaler -> Vectorizer）合并进分类器（fuse_affine_steps）。
+    返回的模型可直接用于 data_evaluation 和 ClfEmissionHMM，但不能再训练。
+    :param model: [feat_extractor, embedder, clf]
+    :return: [feat_extractor, embedder, clf]
+    """
+    feat_extractor, embedder, clf = model
+    steps = getattr(embedder, 'named_steps', {})
+    if 'blockcovariances' in steps and 'tangentspace' in steps:
+        embedder = CompiledRiemannEmbedder(embedder)
+        if isinstance(clf, LogisticRegression):
+            clf = CompiledLinearClassifier(clf)
+    elif isinstance(clf, LogisticRegression):
+        embedder, clf = fuse_affine_steps(embedder, clf)
+    return [feat_extractor, embedder, clf]
+
+
+def fuse_affine_steps(embedder, clf):
+    """
+    把嵌入管道末尾的仿射步骤（ChannelScaler、Vectorizer）与线性分类器预先合成一个 W, b：
+        Vectorizer 只是展平，把 coef 恢复成输入的形状；
+        ChannelScaler x * scale + offset 合并为 W * scale，截距加上 sum(W * offset)。
+    剩余的前缀步骤（如 DecimateFeature）保持不变，分类器直接作用在其输出上，省去中间数组的拷贝。
+    :param embedder: 训练好的 sklearn Pipeline
+    :param clf: 训练好的 LogisticRegression
+    :return: (prefix_embedder, CompiledLinearClassifier)
+    """
+    steps = [step for _, step in embedder.steps]
+    coef, intercept = clf.coef_, clf.intercept_.astype(float)
+    n_fused = 0
+    for step in reversed(steps):
+        if isinstance(step, Vectorizer) and coef.ndim == 2:
+            coef = coef.reshape((len(coef),) + tuple(step.features_shape_))
+        elif isinstance(step, ChannelScaler) and coef.ndim == step.scale_.ndim:
+            axes = tuple(range(1, coef.ndim))
+            intercept = intercept + np.sum(coef * step.offset_, axis=axes)
+            coef = coef * step.scale_
+        else:
+            break
+        n_fused += 1
+    if n_fused == len(steps):
+        prefix = make_pipeline(FunctionTransformer())
+    else:
+        prefix = embedder[:len(steps) - n_fused]
+    return prefix, CompiledLinearClassifier(clf, coef.reshape((len(coef), -1)), intercept)
+
+
+def data_evaluation(model, raw: np.ndarray, fs, events=None, duration=None, return_cls=True, dtype=None):
+    """
+    dtype: 输入数据的精度，例如 np.float32 与放大器数据一致；None 时不转换
+    """
     feat_extractor, embedder, clf = model
+    if dtype is not None:
+        raw = np.asarray(raw, dtype=dtype)
     filtered_data = feat_extractor.transform(raw)
-    if (events is not None) and (duration is not None):
-        X = cut_epochs((0, duration, fs), filtered_data, events[:, 0])
+    if raw.ndim == 3:
+        # already epoched (n_epochs, n_ch, n_times), filtered in one batch
+        X = filtered_data
+    elif (events is not None) and (duration is not None):
+        # features may already be decimated in the extractor
+        feat_fs = getattr(feat_extractor, 'target_fs', None) or fs
+        onsets = np.round(events[:, 0] * feat_fs / fs).astype(int)
+        X = cut_epochs((0, duration, feat_fs), filtered_data, onsets)
     else:
         X = filtered_data[None]
     # embed feature
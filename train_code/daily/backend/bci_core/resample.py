@@ -0,0 +1,231 @@
+"""
+bci_core 共用的多相 FIR 重采样
+抗混叠滤波器与 scipy.signal.resample_poly 的默认设计相同（Kaiser 窗，beta=5，半长 10 * max(up, down)），
+按 (up, down, half_len) 缓存并拆成 up 个子滤波器。每个输出样本只与一个子滤波器做一次点积，
+同一相位的输出在输入上是等间隔（步长 down）的窗口，用 sliding_window_view 一次算出，
+不需要插零、也不计算被丢弃的样本。
+窗长固定的短数据（在线窗口、训练 epoch，不超过 _MAX_MATRIX_LENGTH 个样本）整个运算（含边缘外推）
+对输入是线性的，由子滤波器直接拼出 (n_times, n_out) 的矩阵并缓存，之后每次只需一次矩阵乘法。
+
+    resample_poly: 批量、任意轴，结果与 scipy.signal.resample_poly(padtype='line') 一致
+    StreamingResampler: 有状态的流式版本，逐块输入，输出与整段 resample_poly 的内部样本一致
+"""
+from fractions import Fraction
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+
+def poly_ratio(sfreq, target_fs, max_denominator=10000):
+    """
+    target_fs / sfreq 的最简分数
+    :return: (up, down)
+    """
+    ratio = (Fraction(target_fs) / Fraction(sfreq)).limit_denominator(max_denominator)
+    return ratio.numerator, ratio.denominator
+
+
+@lru_cache(maxsize=32)
+def polyphase_taps(up, down, half_len=None):
+    """
+    抗混叠低通滤波器的多相分解
+    :param half_len: 滤波器半长（升采样后的样本数），None 时与 resample_poly 相同，为 10 * max(up, down)
+    :return: taps, half_len
+        taps: (up, n_taps)，第 p 行为相位 p 的子滤波器 h[p + m * up]，按 m 逆序排列，可直接与输入窗口点积
+    """
+    max_rate = max(up, down)
+    if half_len is None:
+        half_len = 10 * max_rate
+    h = signal.firwin(2 * half_len + 1, 1. / max_rate, window=('kaiser', 5.0)) * up
+    n_taps = -(-len(h) // up)
+    h = np.concatenate((h, np.zeros(n_taps * up - len(h))))
+    taps = np.ascontiguousarray(h.reshape((n_taps, up)).T[:, ::-1])
+    taps.flags.writeable = False
+    return taps, half_len
+
+
+def _input_range(k, up, down, half_len, n_taps):
+    """输出样本 k 用到的输入序号范围 [first, last]"""
+    last = (k * down + half_len) // up
+    return last - n_taps + 1, last
+
+
+def _polyphase(x, taps, up, down, half_len, origin, k0, n_out):
+    """
+    计算输出样本 k0, ..., k0 + n_out - 1：y[k] = Σ_i x[i] h[k * down + half_len - i * up]
+    x: (..., n) 数组，x[..., j] 对应输入序号 j + origin，需覆盖这些输出用到的全部输入
+    """
+    n_taps = taps.shape[1]
+    taps = taps.astype(x.dtype, copy=False)
+    out = np.empty(x.shape[:-1] + (n_out,), dtype=x.dtype)
+    windows = sliding_window_view(x, n_taps, axis=-1)
+    # outputs k, k + up, k + 2up, ... share one phase and step the input by down samples
+    for r in range(min(up, n_out)):
+        k = k0 + r
+        start = _input_range(k, up, down, half_len, n_taps)[0] - origin
+        n_k = len(range(r, n_out, up))
+        phase = (k * down + half_len) % up
+        # einsum handles the overlapping strided windows much faster than matmul
+        out[..., r::up] = np.einsum('...kt,t->...k', windows[..., start:start + (n_k - 1) * down + 1:down, :],
+                                    taps[phase])
+    return out
+
+
+def _as_float(x):
+    x = np.asarray(x)
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(np.float64)
+    return x
+
+
+# the matrix path is only for short fixed windows, long recordings use the direct path
+_MAX_MATRIX_LENGTH = 4096
+_MAX_RESAMPLE_MATRIX = 2 ** 20
+
+
+def resample_poly(x, up, down, axis=-1, half_len=None):
+    """
+    多相 FIR 重采样，边缘按首尾两点的直线外推，结果与 scipy.signal.resample_poly(x, up, down, padtype='line') 一致
+    (误差在浮点舍入量级)，精度与输入相同。
+        x: ndarray，任意维，axis 为时间轴
+        up, down: 升、降采样倍数，例如 poly_ratio(1000, 10) = (1, 100)
+        half_len: 抗混叠滤波器半长，见 polyphase_taps
+    return: ndarray，时间轴长度为 ceil(n_times * up / down)
+    """
+    x = _as_float(x)
+    g = gcd(up, down)
+    up, down = up // g, down // g
+    if up == down == 1:
+        return x.copy()
+    x = np.moveaxis(x, axis, -1)
+    n_in = x.shape[-1]
+    n_out = -(-n_in * up // down)
+    if n_in <= _MAX_MATRIX_LENGTH and n_in * n_out <= _MAX_RESAMPLE_MATRIX:
+        y = x @ _resample_matrix(n_in, up, down, half_len).astype(x.dtype, copy=False)
+    else:
+        y = _resample_direct(x, up, down, half_len)
+    return np.moveaxis(y, -1, axis)
+
+
+def _padding(n_in, up, down, half_len, n_taps):
+    """输出 ceil(n_in * up / down) 个样本时左右两侧需要外推的样本数"""
+    n_out = -(-n_in * up // down)
+    first = _input_range(0, up, down, half_len, n_taps)[0]
+    last = _input_range(n_out - 1, up, down, half_len, n_taps)[1]
+    return n_out, max(0, -first), max(0, last - n_in + 1)
+
+
+@lru_cache(maxsize=16)
+def _resample_matrix(n_in, up, down, half_len):
+    """
+    resample_poly 对应的 (n_in, n_out) 矩阵，由子滤波器直接填入，占用 O((n_in + n_taps) * n_out) 内存
+    外推的样本是首尾两个样本的线性组合，其系数并入第一行和最后一行
+    """
+    taps, half_len = polyphase_taps(up, down, half_len)
+    n_taps = taps.shape[1]
+    n_out, n_left, n_right = _padding(n_in, up, down, half_len, n_taps)
+    # response of every padded input sample
+    k = np.arange(n_out)
+    rows = (k * down + half_len) // up - n_taps + 1 + n_left
+    padded = np.zeros((n_left + n_in + n_right, n_out))
+    padded[rows[:, None] + np.arange(n_taps), k[:, None]] = taps[(k * down + half_len) % up]
+
+    matrix = padded[n_left:n_left + n_in].copy()
+    d = max(n_in - 1, 1)
+    # left: x[0] + t * slope, t < 0; right: x[-1] + t * slope, t > 0; slope = (x[-1] - x[0]) / d
+    t = np.arange(-n_left, 0) / d
+    left = padded[:n_left]
+    matrix[0] += (1 - t) @ left
+    matrix[-1] += t @ left
+    t = np.arange(1, n_right + 1) / d
+    right = padded[n_left + n_in:]
+    matrix[-1] += (1 + t) @ right
+    matrix[0] -= t @ right
+    matrix.flags.writeable = False
+    return matrix
+
+
+def _resample_direct(x, up, down, half_len):
+    """x: (..., n_in) -> (..., n_out)"""
+    taps, half_len = polyphase_taps(up, down, half_len)
+    n_taps = taps.shape[1]
+    n_in = x.shape[-1]
+    n_out, n_left, n_right = _padding(n_in, up, down, half_len, n_taps)
+    slope = (x[..., -1:] - x[..., :1]) / max(n_in - 1, 1)
+    padded = np.concatenate((
+        x[..., :1] + slope * np.arange(-n_left, 0, dtype=x.dtype),
+        x,
+        x[..., -1:] + slope * np.arange(1, n_right + 1, dtype=x.dtype),
+    ), axis=-1)
+    return _polyphase(padded, taps, up, down, half_len, -n_left, 0, n_out)
+
+
+class StreamingResampler:
+    """
+    流式多相 FIR 重采样
+    逐块输入样本，一旦某个输出样本所需的输入全部到达就输出，只保留一个滤波器长度的输入历史。
+    输出与对整段数据调用 resample_poly 的结果一致，只有开头（首个样本按常数向左延拓，而不是直线外推）
+    和尚未输出的末尾不同；代价是 half_len / up 个输入样本的固定延迟（1000Hz -> 10Hz 默认为 1 秒），
+    在线使用时可用较小的 half_len 换取更短的延迟（抗混叠过渡带相应变宽）。
+    Args:
+        up, down: 升、降采样倍数
+        half_len: 抗混叠滤波器半长，见 polyphase_taps
+    """
+    def __init__(self, up, down, half_len=None):
+        g = gcd(up, down)
+        self.up, self.down = up // g, down // g
+        if self.up == self.down == 1:
+            self.taps, self.half_len = None, 0
+        else:
+            self.taps, self.half_len = polyphase_taps(self.up, self.down, half_len)
+        self.reset()
+
+    @property
+    def delay(self):
+        """输出相对输入的延迟（输入样本数）"""
+        return self.half_len / self.up
+
+    def reset(self):
+        self._history = None
+        # input index of self._history[..., 0]
+        self._origin = 0
+        self.n_in = 0
+        self.n_out = 0
+
+    def step(self, data):
+        """
+        Args:
+            data (ndarray): (..., n_new) 新样本，时间轴在最后
+        Returns:
+            out (ndarray): (..., n_ready) 新产生的输出样本，可能为空
+        """
+        data = _as_float(data)
+        if self.taps is None:
+            self.n_in += data.shape[-1]
+            self.n_out = self.n_in
+            return data.copy()
+        n_taps = self.taps.shape[1]
+        if self._history is None:
+            first = _input_range(0, self.up, self.down, self.half_len, n_taps)[0]
+            n_left = max(0, -first)
+            self._history = np.repeat(data[..., :1], n_left, axis=-1)
+            self._origin = -n_left
+        self._history = np.concatenate((self._history, data.astype(self._history.dtype, copy=False)), axis=-1)
+        self.n_in += data.shape[-1]
+
+        # output k is ready once input (k * down + half_len) // up has arrived
+        k_end = max(-(-(self.n_in * self.up - self.half_len) // self.down), self.n_out)
+        if k_end == self.n_out:
+            return np.empty(data.shape[:-1] + (0,), dtype=self._history.dtype)
+        out = _polyphase(self._history, self.taps, self.up, self.down, self.half_len,
+                         self._origin, self.n_out, k_end - self.n_out)
+        self.n_out = k_end
+
+        keep_from = _input_range(k_end, self.up, self.down, self.half_len, n_taps)[0]
+        n_drop = min(max(keep_from - self._origin, 0), self._history.shape[-1])
+        self._history = self._history[..., n_drop:]
+        self._origin += n_drop
+        return out
@@ -202,4 +202,73 @@ def reref(data, method):
         return data
     else:
         raise ValueError(f'Rereference method unacceptable, got {str(method)}, expect "monopolar" or "average" or "bipolar"')
-    
\ No newline at end of file
+
+
+def mirrored_write(buffer, head, block):
+    """
+    两倍容量镜像环形数组的写入，RollingWindow、device.data_client.RingBuffer 和共享内存的
+    device.sample_bus.SampleBusWriter 共用这一实现。
+    每个样本同时写入 head 和 head + capacity 两处，写入后最近 capacity 个样本
+    始终是 buffer[:, new_head:new_head + capacity] 这段连续内存。
+    :param buffer: ndarray (n_rows, 2 * capacity)
+    :param head: 写入位置，0 <= head < capacity
+    :param block: ndarray (n_rows, n_new)，超过 capacity 时只保留最后 capacity 个样本
+    :return: 新的写入位置
+    """
+    capacity = buffer.shape[-1] // 2
+    n = block.shape[-1]
+    if n > capacity:
+        block = block[:, -capacity:]
+        n = capacity
+    first = min(n, capacity - head)
+    rest = n - first
+    # primary part and its mirror
+    buffer[:, head:head + first] = block[:, :first]
+    buffer[:, head + capacity:head + capacity + first] = block[:, :first]
+    if rest > 0:
+        buffer[:, :rest] = block[:, first:]
+        buffer[:, capacity:capacity + rest] = block[:, first:]
+    return (head + n) % capacity
+
+
+class RollingWindow:
+    """
+    固定长度的滑动窗口 (n_rows, length)，新数据在右侧追加
+    内部按两倍长度镜像写入（mirrored_write），窗口始终是连续内存，追加的开销只与新数据长度有关
+    """
+    def __init__(self, n_rows, length, dtype=np.float64):
+        self.length = length
+        self._data = np.zeros((n_rows, 2 * length), dtype=dtype)
+        self._head = 0
+        self.n_filled = 0
+
+    def append(self, block):
+        """
+        :param block: ndarray (n_rows, n_new)
+        """
+        self._head = mirrored_write(self._data, self._head, block)
+        self.n_filled = min(self.n_filled + block.shape[-1], self.length)
+
+    def rewind(self, n):
+        """
+        撤销最近的 n 个样本（之后可用 append 写入修正后的值）
+        """
+        n = min(n, self.n_filled)
+        self._head = (self._head - n) % self.length
+        self.n_filled -= n
+
+    def window(self, n=None):
+        """
+        :param n: number of latest samples, default the whole window
+        :return: ndarray view (n_rows, n)
+        """
+        if n is None:
+            n = self.length
+        end = self._head + self.length
+        return self._data[:, end - n:end]
+
+    def reset(self):
+        self._data[:] = 0
+        self._head = 0
+        self.n_filled = 0
+
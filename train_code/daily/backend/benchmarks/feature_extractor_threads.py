@@ -0,0 +1,53 @@
+"""
+FeatExtractor 串行与线程池并行的耗时对比，用于选择 n_workers
+
+    python -m benchmarks.feature_extractor_threads
+    python -m benchmarks.feature_extractor_threads --n-channel 16 --workers 2 4 8
+"""
+import argparse
+import time
+
+import numpy as np
+
+from bci_core.feature_extractors import FeatExtractor
+
+
+def timeit(func, repeat):
+    func()  # warm up, builds the filter plans and the pool
+    t = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - t) / repeat
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serial vs threaded FeatExtractor.transform')
+    parser.add_argument('--fs', type=int, default=1000)
+    parser.add_argument('--n-channel', type=int, default=8)
+    parser.add_argument('--window', type=float, default=1., help='window length in seconds')
+    parser.add_argument('--epochs', type=int, nargs='+', default=[1, 4, 16, 64, 256],
+                        help='batch sizes, 1 is a single online window')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 3, 4])
+    parser.add_argument('--repeat', type=int, default=5)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    lfb_bands, hg_bands = [(15, 35), (35, 50)], [(55, 95), (105, 145)]
+    extractors = {1: FeatExtractor(args.fs, lfb_bands, hg_bands)}
+    for n in args.workers:
+        extractors[n] = FeatExtractor(args.fs, lfb_bands, hg_bands, n_workers=n)
+
+    rng = np.random.default_rng(0)
+    n_times = int(args.window * args.fs)
+    print(f'{args.n_channel} channels, {n_times} samples per window')
+    print('n_epochs'.rjust(9) + ''.join(f'{f"workers={n}":>20}' for n in extractors))
+    for n_epochs in args.epochs:
+        shape = (args.n_channel, n_times) if n_epochs == 1 else (n_epochs, args.n_channel, n_times)
+        data = rng.standard_normal(shape)
+        times = {n: timeit(lambda: ext.transform(data), args.repeat) for n, ext in extractors.items()}
+        # speedup relative to serial, > 1 means the pool pays off
+        print(f'{n_epochs:>9}' + ''.join(f'{f"{t * 1e3:.2f}ms (x{times[1] / t:.2f})":>20}' for t in times.values()))
+    for ext in extractors.values():
+        ext.close()
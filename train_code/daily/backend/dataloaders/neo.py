@@ -161,6 +161,10 @@ def load_neuracle(data_dir, data_type='ecog'):
     :return:
         raw: mne.io.RawArray
     """
+    if not os.path.isfile(os.path.join(data_dir, 'data.bdf')) and \
+            os.path.isfile(os.path.join(data_dir, 'recording.json')):
+        return load_recording(data_dir, data_type)
+
     f = {
         'data': os.path.join(data_dir, 'data.bdf'),
         'evt': os.path.join(data_dir, 'evt.bdf'),
@@ -201,4 +205,44 @@ def load_neuracle(data_dir, data_type='ecog'):
     except OSError:
         pass
 
-    return raw
\ No newline at end of file
+    return raw
+
+
+def load_recording(data_dir, data_type='ecog'):
+    """
+    loader for the recordings written by device.recorder.FrameRecorder
+    :param
+        data_dir: recording dir with data.raw and recording.json
+        data_type:
+    :return:
+        raw: mne.io.RawArray
+    """
+    with open(os.path.join(data_dir, 'recording.json'), 'r') as json_file:
+        record_info = json.load(json_file)
+    sfreq = record_info['SampleRate']
+    ch_names = record_info['ChannelLabels'][:-1]
+    n_channel = len(record_info['ChannelLabels'])
+    n_samples = record_info['NumberOfSamples']
+
+    if n_samples > 0:
+        frames = np.memmap(os.path.join(data_dir, 'data.raw'), dtype=record_info['DataType'], mode='r',
+                           shape=(n_samples, n_channel))
+    else:
+        frames = np.zeros((0, n_channel), dtype=record_info['DataType'])
+    data = frames[:, :-1].T.astype(np.float64) * 1e-6  # to Volt
+
+    info = mne.create_info(ch_names, sfreq, [data_type] * len(ch_names))
+    raw = mne.io.RawArray(data, info)
+
+    if len(record_info['TriggerOnsets']) > 0:
+        onset, content = np.array(record_info['TriggerOnsets'], dtype=np.int64).T
+        events = np.stack((onset, np.zeros_like(onset), content), axis=1)
+        annotations = mne.annotations_from_events(events, sfreq)
+        raw.set_annotations(annotations)
+
+    # frames dropped while recording are NaN placeholders
+    dropped = np.array(record_info.get('DroppedSegments', []), dtype=np.int64).reshape((-1, 2))
+    if len(dropped) > 0:
+        raw.annotations.append(dropped[:, 0] / sfreq, dropped[:, 1] / sfreq, 'BAD_dropped')
+
+    return raw
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+
+from .data_client import RingBuffer, EventLog, OnlineFilterChain, unpack_data
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncNeuracleDataClient:
+    """NeuracleDataClient 的 asyncio 版本
+    数据接收、决策、trigger 发送和界面刷新可以共用一个事件循环，不需要线程锁。
+    用法:
+        async with AsyncNeuracleDataClient(n_channel=9, samplerate=1000) as client:
+            async for block in client:
+                ...
+            fs, events, data = await client.window(1.)
+    """
+    UPDATE_INTERVAL = 0.04
+    BYTES_PER_NUM = 4
+
+    def __init__(self, n_channel=9, samplerate=1000, host='localhost', port=8712, buffer_len=1.):
+        self.n_channel = n_channel
+        self.samplerate = samplerate
+        self.frame_size = self.BYTES_PER_NUM * n_channel
+        self.block_size = int(self.UPDATE_INTERVAL * samplerate) * self.frame_size
+        self.max_buffer_length = int(buffer_len * samplerate)
+        self.buffer = RingBuffer(n_channel, self.max_buffer_length)
+        self._host = host
+        self._port = port
+
+        self.filter = OnlineFilterChain(samplerate)
+
+        # total number of samples received
+        self.n_samples = 0
+        self.event_log = EventLog()
+        self.dropped_bytes = 0
+        self._reader = None
+        self._writer = None
+        self._task = None
+        self._running = False
+        self._new_data = None
+        # n_samples when window() last returned
+        self._window_end = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+        self._new_data = asyncio.Condition()
+        self._running = True
+        self._task = asyncio.create_task(self._recv_loop())
+
+    def is_active(self):
+        return self._running
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _recv_loop(self):
+        try:
+            while True:
+                try:
+                    raw = await self._reader.readexactly(self.block_size)
+                except asyncio.IncompleteReadError as e:
+                    # connection closed, keep the whole frames of the last partial block
+                    n_whole = len(e.partial) - len(e.partial) % self.frame_size
+                    self.dropped_bytes += len(e.partial) - n_whole
+                    if n_whole > 0:
+                        await self._push(e.partial[:n_whole])
+                    break
+                await self._push(raw)
+        except OSError as e:
+            logger.warning(f'amplifier connection lost: {e}')
+        finally:
+            # wake up waiters so they can notice the client is inactive
+            self._running = False
+            async with self._new_data:
+                self._new_data.notify_all()
+
+    async def _push(self, raw):
+        data = unpack_data(raw, self.n_channel)
+        # do highpass and notch (exclude stim channel)
+        data[:, :-1] = self.filter.filter_incoming(data[:, :-1])
+        self.buffer.write(data.T)
+        self.event_log.extend(data[:, -1], self.n_samples)
+        self.n_samples += data.shape[0]
+        async with self._new_data:
+            self._new_data.notify_all()
+
+    def __aiter__(self):
+        return self.blocks()
+
+    async def blocks(self):
+        """
+        异步迭代新到达的数据块，每个迭代器独立记录读取位置
+        Yields:
+            data (ndarray): (channels, n_new)，包含 trigger 通道
+        """
+        position = self.n_samples
+        while True:
+            async with self._new_data:
+                await self._new_data.wait_for(lambda: self.n_samples > position or not self.is_active())
+            n_new = self.n_samples - position
+            if n_new == 0:
+                return
+            # samples older than the buffer capacity are lost for slow consumers
+            yield self.buffer.read_latest(n_new, copy=True)
+            position += n_new
+
+    async def window(self, seconds):
+        """
+        等待缓冲区中有足够数据、且自上一次 window 调用以来有新数据到达后，返回最近 seconds 秒的数据，
+        因此 while True: await client.window(1.) 这样的循环每次都会让出事件循环，不会阻塞数据接收；
+        连接关闭后直接返回缓冲区中最近的数据
+        Returns:
+            samplerate: number, samplerate
+            events: ndarray (n_events, 3), [onset, duration, event_label]
+            data: ndarray with shape of (channels, timesteps)
+        """
+        n = int(seconds * self.samplerate)
+        if n > self.max_buffer_length:
+            raise ValueError(f'window of {seconds}s exceeds buffer length of {self.max_buffer_length} samples')
+        async with self._new_data:
+            await self._new_data.wait_for(
+                lambda: (len(self.buffer) >= n and self.n_samples > self._window_end) or not self.is_active())
+        # wait_for returns without suspending when the window is already there, yield to the receive task
+        await asyncio.sleep(0)
+        if len(self.buffer) < n:
+            raise ConnectionError('amplifier connection closed before the window was filled')
+        data = self.buffer.read_latest(n, copy=True)
+        self._window_end = self.n_samples
+        start = self.n_samples - n
+        events = self.event_log.since(start)
+        events[:, 0] -= start
+        return self.samplerate, events, data[:-1]
+
+    def get_events(self, since=0):
+        """
+        查询绝对样本序号 >= since 的 trigger 事件
+        :return:
+            events: ndarray (n_events, 3), [onset, duration, event_label]
+        """
+        return self.event_log.since(since)
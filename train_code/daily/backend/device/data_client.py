@@ -1,109 +1,557 @@
+import logging
 import socket
 import threading
+import time
 
 import numpy as np
 from scipy import signal
 
+from bci_core.utils import mirrored_write
+from .recorder import FrameRecorder
+
+
+logger = logging.getLogger(__name__)
 
 class NeuracleDataClient:
     UPDATE_INTERVAL = 0.04
     BYTES_PER_NUM = 4
 
-    def __init__(self, n_channel=9, samplerate=1000, host='localhost', port=8712, buffer_len=1.):
+    def __init__(self, n_channel=9, samplerate=1000, host='localhost', port=8712, buffer_len=1.,
+                 record_dir=None, channel_labels=None, filter_chain=None, stats_interval=None,
+                 reconnect=True, max_backoff=5.):
+        """
+        Args:
+            record_dir (str or None): 不为 None 时将原始数据帧连续记录到该目录，见 FrameRecorder
+            channel_labels (list or None): 记录时使用的通道名
+            filter_chain (OnlineFilterChain or None): 在线预处理，默认与离线预处理一致（高通 + 陷波）
+            stats_interval (float or None): 不为 None 时每隔 stats_interval 秒输出一行接收统计日志
+            reconnect (bool): 连接断开后是否自动重连（指数退避），缓冲区和滤波器状态保持不变
+            max_backoff (float): 重连间隔上限（秒）
+        """
         self.n_channel = n_channel
-        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        self.__sock = None
         self.chunk_size = int(self.UPDATE_INTERVAL * samplerate * self.BYTES_PER_NUM * n_channel)
-        self.buffer = []
+        self.assembler = FrameAssembler(self.BYTES_PER_NUM * n_channel, self.chunk_size)
         self.max_buffer_length = int(buffer_len * samplerate)
+        self.buffer = RingBuffer(n_channel, self.max_buffer_length)
+        # absolute sample counter and trigger events detected on arrival
+        self.n_samples = 0
+        self.event_log = EventLog()
+        # data gaps caused by reconnection, [start, n_samples], filled with NaN in the buffer
+        self.gaps = []
+        self.n_reconnects = 0
         self._host = host
         self._port = port
+        self.reconnect = reconnect
+        self.max_backoff = max_backoff
+        self._closing = threading.Event()
+        self._connected = False
+        self._last_arrival = None
+        self._check_gap = False
         # thread lock
         self.lock = threading.Lock()
-        self.__datathread = threading.Thread(target=self.__recv_loop)
+        self.__datathread = threading.Thread(target=self.__recv_loop, daemon=True)
         self.samplerate = samplerate
 
-        self.filter = OnlineHPFilter(1, samplerate)
+        if filter_chain is None:
+            filter_chain = OnlineFilterChain(samplerate)
+        self.filter = filter_chain
+        # band-passed data channels, filtered once on arrival
+        self.band_buffer = None
+        if getattr(filter_chain, 'bands', None) is not None:
+            self.band_buffer = RingBuffer(len(filter_chain.bands) * (n_channel - 1), self.max_buffer_length)
+
+        self.acq_stats = AcquisitionStats()
+        self.stats_interval = stats_interval
+        self._last_stats_log = time.monotonic()
+
+        self.recorder = None
+        if record_dir is not None:
+            self.recorder = FrameRecorder(record_dir, n_channel, samplerate, channel_labels)
 
         # start client
         self.__config()
 
     def __config(self):
-        self.__sock.connect((self._host, self._port))
+        self.__connect()
         self.__run_forever()
 
+    def __connect(self, timeout=None):
+        sock = socket.create_connection((self._host, self._port), timeout=timeout)
+        sock.settimeout(None)
+        self.__sock = sock
+        self._connected = True
+
     def is_active(self):
-        return self.__sock.fileno() != -1
+        return self._connected and not self._closing.is_set()
+
+    def close(self, timeout=2.):
+        self._closing.set()
+        self.__disconnect()
+        self.__datathread.join(timeout)
+        if self.__datathread.is_alive():
+            logger.warning('receive thread did not stop in time')
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def __disconnect(self):
+        self._connected = False
+        sock = self.__sock
+        if sock is None:
+            return
+        # shutdown wakes up the blocking recv in the receive thread
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
 
-    def close(self):
-        self.__sock.close()
-        self.__datathread.join()
+    def __reconnect(self):
+        """指数退避重连，直到成功或 close() 被调用"""
+        self.__disconnect()
+        self.assembler.reset()
+        delay = 0.1
+        while not self._closing.wait(delay):
+            try:
+                self.__connect(timeout=1.)
+            except OSError as e:
+                logger.warning(f'reconnecting to amplifier failed: {e}, retry in {delay:.1f}s')
+                delay = min(2 * delay, self.max_backoff)
+                continue
+            if self._closing.is_set():
+                self.__disconnect()
+                return
+            self.n_reconnects += 1
+            self._check_gap = True
+            logger.info('amplifier reconnected')
+            return
 
     def __recv_loop(self):
-        while self.is_active():
+        try:
+            self.__recv_frames()
+        except Exception:
+            # is_active() has to report a dead receive thread
+            logger.exception('receive thread stopped unexpectedly')
+        finally:
+            self._connected = False
+
+    def __recv_frames(self):
+        while not self._closing.is_set():
+            n_bytes = self.assembler.n_bytes
             try:
-                data = self.__sock.recv(self.chunk_size)
+                frames = self.assembler.recv_into(self.__sock)
             except OSError:
-                break
-            if len(data) % 4 != 0:
+                frames = None
+            arrival = time.monotonic()
+            if frames is None:
+                # connection closed by peer or broken
+                if self._closing.is_set() or not self.reconnect:
+                    self.assembler.reset()
+                    self._connected = False
+                    break
+                logger.warning('amplifier connection lost, reconnecting')
+                self.__reconnect()
                 continue
+            if len(frames) == 0:
+                continue
+
+            if self._check_gap:
+                self._check_gap = False
+                # nothing to align to if the first connection dropped before any packet arrived
+                if self._last_arrival is not None:
+                    n_frames = len(frames) // self.assembler.frame_size
+                    self._fill_gap(int(round((arrival - self._last_arrival) * self.samplerate)) - n_frames)
+            self._last_arrival = arrival
+
+            if self.recorder is not None:
+                self.recorder.put(frames)
 
             # unpack data
-            data = self._unpack_data(data)
+            data = self._unpack_data(frames)
 
-            # do highpass (exclude stim channel)
+            # do highpass and notch (exclude stim channel)
             data[:, :-1] = self.filter.filter_incoming(data[:, :-1])
+            if self.band_buffer is not None:
+                band_data = self.filter.filter_bands(data[:, :-1])
 
-            # update buffer
+            # update buffer, old data are overwritten in place
+            t = time.perf_counter()
             self.lock.acquire()
-            self.buffer.extend(data.tolist())
-            # remove old data
-            old_data_len = len(self.buffer) - self.max_buffer_length
-            if old_data_len > 0:
-                self.buffer = self.buffer[old_data_len:]
+            lock_wait = time.perf_counter() - t
+            self.buffer.write(data.T)
+            if self.band_buffer is not None:
+                self.band_buffer.write(band_data.T)
+            self.event_log.extend(data[:, -1], self.n_samples)
+            self.n_samples += data.shape[0]
             self.lock.release()
-    
+
+            self.acq_stats.record(arrival, self.assembler.n_bytes - n_bytes, lock_wait)
+            if self.stats_interval is not None and arrival - self._last_stats_log >= self.stats_interval:
+                self._last_stats_log = arrival
+                self._log_stats()
+
+    def _fill_gap(self, n_missing):
+        """
+        以 NaN（trigger 通道为 0）填补断线期间丢失的样本，保持绝对样本序号与时间对齐。
+        缺失样本数由断线前后数据包的到达时间估计，滤波器状态不受影响。
+        """
+        if n_missing <= 0:
+            return
+        logger.warning(f'{n_missing} samples lost during reconnection')
+        gap = np.full((n_missing, self.n_channel), np.nan, dtype=np.float32)
+        gap[:, -1] = 0
+        if self.recorder is not None:
+            self.recorder.put(gap.tobytes())
+        with self.lock:
+            self.gaps.append((self.n_samples, n_missing))
+            # only the latest samples fit in the buffer
+            self.buffer.write(gap[-self.buffer.capacity:].T)
+            if self.band_buffer is not None:
+                self.band_buffer.write(np.full((self.band_buffer.n_channel, min(n_missing, self.band_buffer.capacity)),
+                                               np.nan, dtype=np.float32))
+            self.n_samples += n_missing
+
     def _unpack_data(self, bytes_data):
-        byte_data = bytearray(bytes_data)
-        if len(byte_data) % 4 != 0:
-            raise ValueError
-        data = np.frombuffer(byte_data, dtype='<f')
-        data = np.reshape(data, (-1, self.n_channel))
-        # from uV to V, ignore event channel
-        data[:, :-1] *= 1e-6
-        return data
+        return unpack_data(bytes_data, self.n_channel)
+
+    def stats(self):
+        """
+        接收统计快照，不加锁，用于判断解码是否跟不上放大器
+        :return:
+            dict: 包数、字节数、包间隔及抖动 (s)、每次读取字节数、缓冲区占用率、取锁等待时间 (s)、
+                最新数据包距今时间 (s)、帧重组、重连与数据缺口统计
+        """
+        stats = self.acq_stats.snapshot()
+        stats['n_samples'] = self.n_samples
+        stats['buffer_fill'] = len(self.buffer) / self.buffer.capacity
+        stats['split_reads'] = self.assembler.split_reads
+        stats['dropped_bytes'] = self.assembler.dropped_bytes
+        stats['n_reconnects'] = self.n_reconnects
+        stats['gap_samples'] = sum(n for _, n in self.gaps)
+        if self.recorder is not None:
+            stats['recorder_dropped_samples'] = self.recorder.dropped_samples
+        return stats
+
+    def _log_stats(self):
+        stats = self.stats()
+        logger.info('acquisition: packets {n_packets}, interval {interval_mean:.4f}s (jitter {interval_std:.4f}s, '
+                    'max {interval_max:.4f}s), {bytes_mean:.0f} bytes/read, buffer {buffer_fill:.0%}, '
+                    'lock wait max {lock_wait_max:.6f}s, latest packet {age:.4f}s ago'.format(**stats))
 
     def __run_forever(self):
         self.__datathread.start()
 
-    def get_trial_data(self, clear=False):
+    def get_trial_data(self, clear=False, return_gap_mask=False):
         """
         called to copy trial data from buffer
+        断线丢失的样本在 data 中为 NaN，解码前应检查 gap_mask 或跳过含 NaN 的窗口
         :args
             clear (bool): 
+            return_gap_mask (bool): 是否同时返回 gap_mask
         :return:
             samplerate: number, samplerate
             events: ndarray (n_events, 3), [onset, duration, event_label]
             data: ndarray with shape of (channels, timesteps)
+            gap_mask: ndarray (timesteps,) bool，断线丢失的样本为 True，仅 return_gap_mask 为 True 时返回
         """
-        self.lock.acquire()
-        data = self.buffer.copy()
-        self.lock.release()
-        data = np.array(data)
-        trigger_channel = data[:, -1]
-        onset = np.flatnonzero(trigger_channel)
-        event_label = trigger_channel[onset]
-        events = np.stack((onset, np.zeros_like(onset), event_label), axis=1)
-        if clear:
-            self.buffer.clear()
-        return self.samplerate, events, data[:, :-1].T
+        with self.lock:
+            data = self.buffer.read_latest(copy=True)
+            # absolute index of the first sample in data
+            start = self.n_samples - data.shape[1]
+            events = self.event_log.since(start)
+            if return_gap_mask:
+                gap_mask = self.gap_mask(start, data.shape[1])
+            if clear:
+                self.buffer.clear()
+                if self.band_buffer is not None:
+                    self.band_buffer.clear()
+        events[:, 0] -= start
+        if return_gap_mask:
+            return self.samplerate, events, data[:-1], gap_mask
+        return self.samplerate, events, data[:-1]
 
+    def get_band_data(self):
+        """
+        filter_chain 设置了 bands 时，样本到达时带通滤波后的各频带数据，与 get_trial_data 的样本对齐
+        :return:
+            samplerate: number, samplerate
+            events: ndarray (n_events, 3), [onset, duration, event_label]
+            data: ndarray (n_bands * (n_channel - 1), timesteps)，频带在前、通道在后，断线丢失的样本为 NaN
+        """
+        if self.band_buffer is None:
+            raise ValueError('filter_chain has no bands')
+        with self.lock:
+            data = self.band_buffer.read_latest(copy=True)
+            start = self.n_samples - data.shape[1]
+            events = self.event_log.since(start)
+        events[:, 0] -= start
+        return self.samplerate, events, data
 
-class OnlineHPFilter:
-    # online 必须要有高通滤波，需要注意。因为设备不滤基线。还没完全弄懂为啥。
-    def __init__(self, freq=1, fs=1000):
-        self.sos = signal.butter(2, freq, btype='hp', fs=fs, output='sos')
+    def gap_mask(self, start, n):
+        """
+        绝对样本序号 [start, start + n) 中断线丢失的样本
+        :return:
+            mask: ndarray (n,) bool
+        """
+        mask = np.zeros(n, dtype=bool)
+        for onset, n_missing in self.gaps:
+            lo, hi = max(onset - start, 0), min(onset + n_missing - start, n)
+            if lo < hi:
+                mask[lo:hi] = True
+        return mask
+
+    def get_events(self, since=0):
+        """
+        查询绝对样本序号 >= since 的 trigger 事件，序号从连接开始累计，多次调用结果一致
+        :return:
+            events: ndarray (n_events, 3), [onset, duration, event_label]
+        """
+        with self.lock:
+            return self.event_log.since(since)
+
+
+def unpack_data(bytes_data, n_channel):
+    """
+    解析 Neuracle 数据流: little-endian float32，按样本交错排列，最后一个通道为 trigger
+    Returns:
+        data (ndarray): (n_times, n_channel)
+    """
+    byte_data = bytearray(bytes_data)
+    if len(byte_data) % 4 != 0:
+        raise ValueError
+    data = np.frombuffer(byte_data, dtype='<f')
+    data = np.reshape(data, (-1, n_channel))
+    # from uV to V, ignore event channel
+    data[:, :-1] *= 1e-6
+    return data
+
+
+class AcquisitionStats:
+    """接收线程的统计信息
+    只有接收线程写入（预分配的环形数组 + 计数器），读取方直接拷贝快照，不需要锁。
+    快照可能与正在写入的一个包错开，对统计用途没有影响。
+    Args:
+        history (int): 保留最近多少个数据包的记录
+    """
+    def __init__(self, history=256):
+        self.history = history
+        self._arrival = np.zeros(history)
+        self._n_bytes = np.zeros(history, dtype=np.int64)
+        self._lock_wait = np.zeros(history)
+        self.n_packets = 0
+        self.total_bytes = 0
+
+    def record(self, arrival, n_bytes, lock_wait):
+        """
+        Args:
+            arrival (float): time.monotonic() 到达时间
+            n_bytes (int): 本次读取的字节数
+            lock_wait (float): 写缓冲区时等待锁的时间
+        """
+        i = self.n_packets % self.history
+        self._arrival[i] = arrival
+        self._n_bytes[i] = n_bytes
+        self._lock_wait[i] = lock_wait
+        self.total_bytes += n_bytes
+        self.n_packets += 1
+
+    def snapshot(self):
+        n_packets = self.n_packets
+        n = min(n_packets, self.history)
+        # oldest to newest
+        order = (np.arange(n) + n_packets - n) % self.history
+        arrival = self._arrival[order]
+        interval = np.diff(arrival)
+        has_interval = len(interval) > 0
+        return {
+            'n_packets': n_packets,
+            'n_bytes': self.total_bytes,
+            'interval_mean': interval.mean() if has_interval else np.nan,
+            'interval_std': interval.std() if has_interval else np.nan,
+            'interval_max': interval.max() if has_interval else np.nan,
+            'bytes_mean': self._n_bytes[order].mean() if n > 0 else np.nan,
+            'lock_wait_mean': self._lock_wait[order].mean() if n > 0 else np.nan,
+            'lock_wait_max': self._lock_wait[order].max() if n > 0 else np.nan,
+            'age': time.monotonic() - arrival[-1] if n > 0 else np.nan,
+        }
+
+
+class EventLog:
+    """trigger 事件记录，onset 为绝对样本序号
+    数据到达时只在新样本上检测一次 trigger，查询按 onset 二分，开销与新样本数成正比。
+    """
+    def __init__(self, capacity=1024):
+        self._events = np.zeros((capacity, 3), dtype=np.int64)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, trigger, offset):
+        """
+        Args:
+            trigger (ndarray): (n_times,) 新到达样本的 trigger 通道
+            offset (int): trigger[0] 的绝对样本序号
+        """
+        onset = np.flatnonzero(trigger)
+        if len(onset) == 0:
+            return
+        end = self._size + len(onset)
+        if end > len(self._events):
+            events = np.zeros((max(2 * len(self._events), end), 3), dtype=np.int64)
+            events[:self._size] = self._events[:self._size]
+            self._events = events
+        self._events[self._size:end, 0] = onset + offset
+        self._events[self._size:end, 2] = trigger[onset]
+        self._size = end
+
+    def since(self, sample):
+        """
+        Returns:
+            events (ndarray): (n_events, 3) 的拷贝，onset >= sample
+        """
+        i = np.searchsorted(self._events[:self._size, 0], sample, side='left')
+        return self._events[i:self._size].copy()
+
+
+class FrameAssembler:
+    """TCP 字节流的帧重组
+    TCP 会任意拆分/合并报文段，一次 recv 不一定落在样本边界上。
+    这里用预分配的 bytearray 持续累积字节，每次只输出完整帧 (n_channel * 4 bytes)，
+    不完整的尾部保留到下一次读取。
+    Args:
+        frame_size (int): 每帧字节数
+        chunk_size (int): 单次 recv 的最大字节数
+    """
+    def __init__(self, frame_size, chunk_size):
+        self.frame_size = frame_size
+        self.chunk_size = chunk_size
+        self._buf = bytearray(chunk_size + frame_size)
+        self._view = memoryview(self._buf)
+        # [_start, _end) 为上次剩余的不完整帧
+        self._start = 0
+        self._end = 0
+        self.n_bytes = 0
+        self.n_frames = 0
+        self.split_reads = 0
+        self.dropped_bytes = 0
+
+    @property
+    def pending_bytes(self):
+        return self._end - self._start
+
+    def recv_into(self, sock):
+        """从 socket 读取一次
+        Returns:
+            frames (memoryview or None): 完整帧的字节，下一次调用前有效；连接关闭时返回 None
+        """
+        # carry the remainder over to the front of the buffer
+        remainder = self._end - self._start
+        if remainder > 0 and self._start > 0:
+            self._buf[:remainder] = self._buf[self._start:self._end]
+        self._start = 0
+        self._end = remainder
+
+        n = sock.recv_into(self._view[self._end:self._end + self.chunk_size])
+        if n == 0:
+            return None
+        self.n_bytes += n
+        self._end += n
+
+        n_whole = self._end - self._end % self.frame_size
+        if n_whole != self._end:
+            self.split_reads += 1
+        self._start = n_whole
+        self.n_frames += n_whole // self.frame_size
+        return self._view[:n_whole]
+
+    def reset(self):
+        """丢弃未完成的帧，重新开始对齐"""
+        self.dropped_bytes += self._end - self._start
+        self._start = 0
+        self._end = 0
+
+
+class RingBuffer:
+    """固定容量的环形缓冲区，数据按 (n_channel, n_times) 存放，float32
+    内部按两倍容量镜像写入（bci_core.utils.mirrored_write），任意时刻最近 N 个样本在内存中都是连续的，
+    读取时可以直接返回视图，不会产生逐样本的 Python 对象。
+    """
+    def __init__(self, n_channel, capacity, dtype=np.float32):
+        self.n_channel = n_channel
+        self.capacity = capacity
+        self._data = np.zeros((n_channel, 2 * capacity), dtype=dtype)
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def write(self, block):
+        """
+        Args:
+            block (ndarray): (n_channel, n_times)
+        """
+        self._head = mirrored_write(self._data, self._head, block)
+        self._size = min(self._size + block.shape[1], self.capacity)
+
+    def read_latest(self, n=None, copy=True):
+        """读取最近 n 个样本
+        Args:
+            n (int or None): 样本数，None 表示读取全部已缓存数据
+            copy (bool): False 时返回内部连续视图，调用方需自行保证读取期间没有写入
+        Returns:
+            data (ndarray): (n_channel, n)
+        """
+        if n is None or n > self._size:
+            n = self._size
+        end = self._head + self.capacity
+        data = self._data[:, end - n:end]
+        if copy:
+            data = data.copy()
+        return data
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+
+class OnlineFilterChain:
+    """在线有状态 SOS 滤波链：高通 + 工频陷波梳 + 可选带通频带
+    默认参数与离线 dataloaders.neo.preprocessing 对齐（1Hz 高通，50/100/150Hz 陷波），
+    样本到达时只滤一次，每个通道保留各自的滤波器状态 zi。
+    Args:
+        fs (float): 采样率
+        highpass (float or None): 高通截止频率，None 表示不做高通
+        notch (tuple or None): 陷波频率，高于 Nyquist 的频率会被忽略
+        notch_width (float): 陷波带宽 (Hz)
+        bands (list or None): 带通频带 [(l_freq, h_freq), ...]，在高通和陷波之后由 filter_bands 分别滤波，
+            滤波器与 LFPExtractor 相同（StreamingLFPExtractor），结果与 LFPExtractor(phase='forward') 一致。
+            NeuracleDataClient 把各频带的数据保存在 band_buffer 中（get_band_data），
+            解码时不必再对每个窗口重新带通滤波
+    """
+    def __init__(self, fs=1000, highpass=1, notch=(50, 100, 150), notch_width=3, bands=None):
+        self.fs = fs
+        sos = []
+        if highpass is not None:
+            sos.append(signal.butter(2, highpass, btype='hp', fs=fs, output='sos'))
+        if notch is not None:
+            for f0 in notch:
+                if f0 >= fs / 2:
+                    continue
+                b, a = signal.iirnotch(f0, f0 / notch_width, fs=fs)
+                sos.append(signal.tf2sos(b, a))
+        # all stages are cascaded into a single sos array, one sosfilt call per packet
+        self.sos = np.concatenate(sos, axis=0) if sos else None
         self._z = None
 
+        self.bands = bands
+        self.band_filter = None
+        if bands is not None:
+            # mne is only needed for the band stage
+            from bci_core.feature_extractors import StreamingLFPExtractor
+            self.band_filter = StreamingLFPExtractor(fs, bands, None)
+
     def filter_incoming(self, data):
         """
         Args: 
@@ -111,8 +559,30 @@ class OnlineHPFilter:
         Returns:
             y (ndarray): (n_times, n_chs)
         """
-        if self._z is None:
-            self._z = np.zeros((self.sos.shape[0], 2, data.shape[1]))
-
-        y, self._z = signal.sosfilt(self.sos, data, axis=0, zi=self._z)
+        y = data
+        if self.sos is not None:
+            if self._z is None:
+                self._z = np.zeros((self.sos.shape[0], 2, data.shape[1]))
+            y, self._z = signal.sosfilt(self.sos, data, axis=0, zi=self._z)
         return y
+
+    def filter_bands(self, data):
+        """
+        各带通频带的有状态滤波，输入为 filter_incoming 的输出
+        Args:
+            data (ndarray): (n_times, n_chs)
+        Returns:
+            y (ndarray): (n_times, n_bands * n_chs)，频带在前、通道在后，与 LFPExtractor 相同
+        """
+        return self.band_filter.filter(data.T).T
+
+    def reset(self):
+        self._z = None
+        if self.band_filter is not None:
+            self.band_filter.reset()
+
+
+class OnlineHPFilter(OnlineFilterChain):
+    # online 必须要有高通滤波，需要注意。因为设备不滤基线。还没完全弄懂为啥。
+    def __init__(self, freq=1, fs=1000):
+        super(OnlineHPFilter, self).__init__(fs, highpass=freq, notch=None)
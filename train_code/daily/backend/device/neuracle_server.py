@@ -0,0 +1,230 @@
+"""
+本地 Neuracle 放大器替身服务，用于回放与压力测试
+
+数据格式与 NeuracleDataClient._unpack_data 一致：little-endian float32，按样本交错排列，
+数据通道单位为 uV，最后一个通道为 trigger。
+
+    python -m device.neuracle_server --data-dir ./tests/data/1 --speed 10
+    python -m device.neuracle_server --n-channel 9 --samplerate 1000 --jitter 0.005
+"""
+import argparse
+import logging
+import socket
+import threading
+import time
+
+import numpy as np
+from scipy import signal
+
+
+logger = logging.getLogger(__name__)
+
+
+class SyntheticSource:
+    """合成多通道 ECoG：1/f 背景 + 50Hz 工频 + 直流偏置，STIM 通道定期写入 trigger"""
+    def __init__(self, n_channel=9, samplerate=1000, trigger_interval=5., trigger_codes=(1, 2, 3), seed=None):
+        self.n_channel = n_channel
+        self.samplerate = samplerate
+        self.trigger_interval = int(trigger_interval * samplerate) if trigger_interval else None
+        self.trigger_codes = trigger_codes
+        self._rng = np.random.default_rng(seed)
+        # leaky integrator for a pink-ish spectrum
+        self._b, self._a = [1.], [1., -0.98]
+        self._z = np.zeros((1, n_channel - 1))
+        self._offset = self._rng.uniform(-500, 500, n_channel - 1)
+        self._n = 0
+        self._n_trigger = 0
+
+    def read(self, n_times):
+        """
+        Returns:
+            data (ndarray): (n_times, n_channel)，数据通道单位 uV
+        """
+        data = np.zeros((n_times, self.n_channel), dtype='<f')
+        noise = self._rng.standard_normal((n_times, self.n_channel - 1))
+        background, self._z = signal.lfilter(self._b, self._a, noise, axis=0, zi=self._z)
+        t = (self._n + np.arange(n_times)) / self.samplerate
+        line = 20 * np.sin(2 * np.pi * 50 * t)
+        data[:, :-1] = 5 * background + line[:, None] + self._offset
+
+        if self.trigger_interval is not None:
+            ind = np.arange(self._n, self._n + n_times)
+            onset = ind[(ind % self.trigger_interval == 0) & (ind > 0)]
+            for o in onset:
+                data[o - self._n, -1] = self.trigger_codes[self._n_trigger % len(self.trigger_codes)]
+                self._n_trigger += 1
+        self._n += n_times
+        return data
+
+
+class ReplaySource:
+    """回放已记录的 data.bdf / evt.bdf 数据，读完后从头循环"""
+    def __init__(self, data_dir, loop=True):
+        from dataloaders.neo import load_neuracle
+        import mne
+
+        raw = load_neuracle(data_dir)
+        self.samplerate = int(raw.info['sfreq'])
+        data = raw.get_data() * 1e6  # to uV
+        stim = np.zeros(data.shape[1])
+        if len(raw.annotations) > 0:
+            events, _ = mne.events_from_annotations(raw, event_id=lambda d: int(d), verbose=False)
+            events = events[events[:, 0] < data.shape[1]]
+            stim[events[:, 0]] = events[:, 2]
+        self._data = np.concatenate((data, stim[None]), axis=0).T.astype('<f')
+        self.n_channel = self._data.shape[1]
+        self.loop = loop
+        self._n = 0
+
+    def read(self, n_times):
+        if self.loop:
+            ind = (self._n + np.arange(n_times)) % len(self._data)
+        else:
+            ind = np.arange(self._n, min(self._n + n_times, len(self._data)))
+        self._n += len(ind)
+        return self._data[ind]
+
+
+class NeuracleSimServer:
+    """模拟放大器的 TCP 服务端
+    单一数据流按固定节拍广播给所有已连接客户端，没有客户端时数据流照常推进，与真实放大器一致。
+    Args:
+        source: SyntheticSource 或 ReplaySource
+        host, port: 监听地址，port=0 时自动分配，可通过 self.port 获取
+        packet_interval (float): 每个数据包的时长（秒）
+        jitter (float): 发包时间抖动的标准差（秒），不会累积
+        speed (float): 相对实时的倍速，例如 10 表示 10 倍速
+        fragment (bool): 随机拆分发送，用于测试客户端的帧重组
+    """
+    def __init__(self, source, host='127.0.0.1', port=8712, packet_interval=0.04, jitter=0., speed=1.,
+                 fragment=False, seed=None):
+        self.source = source
+        self.samplerate = source.samplerate
+        self.packet_samples = max(int(packet_interval * self.samplerate), 1)
+        self.jitter = jitter
+        self.speed = speed
+        self.fragment = fragment
+        self._rng = np.random.default_rng(seed)
+
+        self._server = socket.create_server((host, port))
+        self.host, self.port = self._server.getsockname()[:2]
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._stream_thread = threading.Thread(target=self._stream_loop, daemon=True)
+        self.n_samples_sent = 0
+
+    def start(self):
+        self._accept_thread.start()
+        self._stream_thread.start()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def n_clients(self):
+        with self._clients_lock:
+            return len(self._clients)
+
+    def drop_clients(self):
+        """断开所有客户端，模拟放大器软件重启"""
+        with self._clients_lock:
+            clients, self._clients = self._clients, []
+        for c in clients:
+            _close_socket(c)
+
+    def close(self):
+        self._stop.set()
+        _close_socket(self._server)
+        self.drop_clients()
+        self._accept_thread.join(1.)
+        self._stream_thread.join(1.)
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                conn, addr = self._server.accept()
+            except OSError:
+                break
+            logger.info(f'client connected: {addr}')
+            with self._clients_lock:
+                self._clients.append(conn)
+
+    def _stream_loop(self):
+        period = self.packet_samples / self.samplerate / self.speed
+        next_t = time.perf_counter()
+        while not self._stop.is_set():
+            data = self.source.read(self.packet_samples)
+            if len(data) == 0:
+                break
+            self._broadcast(data.tobytes())
+            self.n_samples_sent += len(data)
+
+            next_t += period
+            delay = next_t - time.perf_counter()
+            if self.jitter > 0:
+                delay += abs(self._rng.normal(0, self.jitter))
+            if delay > 0:
+                time.sleep(delay)
+
+    def _broadcast(self, payload):
+        with self._clients_lock:
+            clients = list(self._clients)
+        for c in clients:
+            try:
+                if self.fragment:
+                    cuts = np.sort(self._rng.integers(0, len(payload), 3))
+                    for part in np.split(np.frombuffer(payload, dtype=np.uint8), cuts):
+                        c.sendall(part.tobytes())
+                else:
+                    c.sendall(payload)
+            except OSError:
+                with self._clients_lock:
+                    if c in self._clients:
+                        self._clients.remove(c)
+                _close_socket(c)
+
+
+def _close_socket(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Local Neuracle amplifier stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8712)
+    parser.add_argument('--data-dir', default=None, help='replay a recorded session (data.bdf, evt.bdf)')
+    parser.add_argument('--n-channel', type=int, default=9, help='including the STIM channel')
+    parser.add_argument('--samplerate', type=int, default=1000)
+    parser.add_argument('--trigger-interval', type=float, default=5.)
+    parser.add_argument('--jitter', type=float, default=0.)
+    parser.add_argument('--speed', type=float, default=1.)
+    parser.add_argument('--fragment', action='store_true')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    if args.data_dir is not None:
+        source = ReplaySource(args.data_dir)
+    else:
+        source = SyntheticSource(args.n_channel, args.samplerate, args.trigger_interval)
+    server = NeuracleSimServer(source, args.host, args.port, jitter=args.jitter, speed=args.speed,
+                               fragment=args.fragment)
+    server.start()
+    logger.info(f'serving {source.n_channel} channels at {source.samplerate}Hz on {server.host}:{server.port}')
+    try:
+        while True:
+            time.sleep(1.)
+    except KeyboardInterrupt:
+        server.close()
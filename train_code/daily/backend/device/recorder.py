@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRecorder:
+    """将原始数据帧连续写入磁盘
+    接收线程只把数据放入队列（不阻塞），后台写线程写入预分配的内存映射文件，空间不够时按倍数扩容。
+    文件与放大器数据格式一致：little-endian float32，(n_times, n_channel)，数据通道单位 uV，最后一个通道为 trigger。
+    关闭时截断到实际长度，并写出 sidecar json（采样率、通道名、trigger onset、丢失的样本段），
+    可直接通过 dataloaders.neo.load_neuracle 读取。
+    写队列满时丢弃的数据以同样长度的 NaN 块（trigger 通道为 0）占位，之后的样本序号和 trigger onset 保持不变，
+    丢失的样本段记录在 DroppedSegments 中，读取时标注为 BAD_dropped。
+    Args:
+        data_dir (str): 记录目录
+        n_channel (int): 通道数（含 trigger 通道）
+        samplerate (int): 采样率
+        channel_labels (list or None): 通道名，最后一个为 trigger 通道
+        initial_duration (float): 预分配的时长（秒）
+        queue_size (int): 写队列长度，写满时丢弃新到达的数据，以 NaN 占位
+    """
+    DATA_FILE = 'data.raw'
+    INFO_FILE = 'recording.json'
+    DTYPE = '<f'
+
+    def __init__(self, data_dir, n_channel, samplerate, channel_labels=None, initial_duration=600., queue_size=1024):
+        os.makedirs(data_dir, exist_ok=True)
+        self.data_dir = data_dir
+        self.n_channel = n_channel
+        self.samplerate = samplerate
+        if channel_labels is None:
+            channel_labels = [f'CH{i + 1:03d}' for i in range(n_channel - 1)] + ['STIM']
+        if len(channel_labels) != n_channel:
+            raise ValueError(f'Expect {n_channel} channel labels, got {len(channel_labels)}')
+        self.channel_labels = list(channel_labels)
+
+        self.n_samples = 0
+        self.dropped_samples = 0
+        # [onset, n_samples] of the placeholders written for dropped frames
+        self.dropped_segments = []
+        self.trigger_onsets = []
+        # samples dropped since the last block that made it into the queue
+        self._n_pending_drop = 0
+        self.begin_timestamp = None
+
+        self._frame_size = np.dtype(self.DTYPE).itemsize * n_channel
+        self._capacity = max(int(initial_duration * samplerate), 1)
+        self._file_path = os.path.join(data_dir, self.DATA_FILE)
+        with open(self._file_path, 'wb') as f:
+            f.truncate(self._capacity * self._frame_size)
+        self._map()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _map(self):
+        self._mm = np.memmap(self._file_path, dtype=self.DTYPE, mode='r+', shape=(self._capacity, self.n_channel))
+
+    def _grow(self, n_required):
+        capacity = self._capacity
+        while capacity < n_required:
+            capacity *= 2
+        self._mm.flush()
+        del self._mm
+        with open(self._file_path, 'r+b') as f:
+            f.truncate(capacity * self._frame_size)
+        self._capacity = capacity
+        self._map()
+
+    def put(self, frames):
+        """
+        由接收线程调用，不阻塞
+        Args:
+            frames (bytes-like): 完整帧的原始字节
+        """
+        if self.begin_timestamp is None:
+            self.begin_timestamp = time.time()
+        try:
+            # the writer puts a placeholder for the frames dropped before this block
+            self._queue.put_nowait((self._n_pending_drop, bytes(frames)))
+            self._n_pending_drop = 0
+        except queue.Full:
+            n_dropped = len(frames) // self._frame_size
+            self._n_pending_drop += n_dropped
+            self.dropped_samples += n_dropped
+            logger.warning('recording queue is full, frames dropped')
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            n_dropped, block = item
+            self._write_gap(n_dropped)
+            self._write(np.frombuffer(block, dtype=self.DTYPE).reshape((-1, self.n_channel)))
+
+    def _write(self, data):
+        end = self.n_samples + len(data)
+        if end > self._capacity:
+            self._grow(end)
+        self._mm[self.n_samples:end] = data
+        onset = np.flatnonzero(data[:, -1])
+        self.trigger_onsets.extend((int(self.n_samples + o), int(data[o, -1])) for o in onset)
+        self.n_samples = end
+
+    def _write_gap(self, n):
+        if n == 0:
+            return
+        self.dropped_segments.append([self.n_samples, n])
+        gap = np.full((n, self.n_channel), np.nan, dtype=self.DTYPE)
+        gap[:, -1] = 0
+        self._write(gap)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        # frames dropped after the last queued block
+        self._write_gap(self._n_pending_drop)
+        self._n_pending_drop = 0
+        self._mm.flush()
+        del self._mm
+        with open(self._file_path, 'r+b') as f:
+            f.truncate(self.n_samples * self._frame_size)
+        info = {
+            'SampleRate': self.samplerate,
+            'ChannelLabels': self.channel_labels,
+            'NumberOfSamples': self.n_samples,
+            'DataType': self.DTYPE,
+            'Unit': 'uV',
+            'BeginTimeStamp': None if self.begin_timestamp is None else int(self.begin_timestamp * 1e3),
+            'DroppedSamples': self.dropped_samples,
+            'DroppedSegments': self.dropped_segments,
+            'TriggerOnsets': self.trigger_onsets,
+        }
+        with open(os.path.join(self.data_dir, self.INFO_FILE), 'w') as json_file:
+            json.dump(info, json_file, indent=2)
@@ -0,0 +1,232 @@
+import logging
+import multiprocessing
+import socket
+import sys
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from bci_core.utils import mirrored_write
+from .data_client import NeuracleDataClient, FrameAssembler, OnlineFilterChain, unpack_data
+
+
+logger = logging.getLogger(__name__)
+
+
+# header layout (int64): sequence counter, total samples written, n_channel, capacity, samplerate
+_HEADER_LEN = 5
+_SEQ, _TOTAL, _N_CHANNEL, _CAPACITY, _SAMPLERATE = range(_HEADER_LEN)
+
+
+def _attach(name):
+    """挂载已存在的共享内存，不向 resource tracker 注册
+    共享内存只归创建者（SampleBusPublisher）所有，否则独立启动的读端进程退出时会把它 unlink 掉
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args, **kwargs: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _layout(shm, n_channel=None, capacity=None):
+    """共享内存上的头部和数据视图，未给出尺寸时从头部读取"""
+    header = np.ndarray((_HEADER_LEN,), dtype=np.int64, buffer=shm.buf)
+    if n_channel is None:
+        n_channel, capacity = int(header[_N_CHANNEL]), int(header[_CAPACITY])
+    data = np.ndarray((n_channel, 2 * capacity), dtype=np.float32,
+                      buffer=shm.buf, offset=header.nbytes)
+    return header, data
+
+
+class SampleBusWriter:
+    """共享内存环形缓冲区的写端
+    数据布局与 RingBuffer 相同（两倍容量镜像写入，mirrored_write），另外在头部记录序列号和累计样本数。
+    写入前后各递增一次序列号（seqlock），读端据此判断读取期间是否有写入。
+    """
+    def __init__(self, name):
+        self.shm = _attach(name)
+        self.header, self._data = _layout(self.shm)
+        self.n_channel = int(self.header[_N_CHANNEL])
+        self.capacity = int(self.header[_CAPACITY])
+
+    def write(self, block):
+        """
+        Args:
+            block (ndarray): (n_channel, n_times)
+        """
+        total = int(self.header[_TOTAL])
+        self.header[_SEQ] += 1
+        mirrored_write(self._data, total % self.capacity, block)
+        self.header[_TOTAL] = total + block.shape[1]
+        self.header[_SEQ] += 1
+
+    def close(self):
+        self.header = None
+        self._data = None
+        self.shm.close()
+
+
+class SampleBusReader:
+    """共享内存环形缓冲区的读端，可在任意本地进程中按名字挂载
+    read_latest(copy=False) 直接返回共享内存上的视图（零拷贝），
+    之后可用 overwritten() 检查这段数据在使用期间是否已被覆盖。
+    接口 get_trial_data 与 NeuracleDataClient 保持一致，可直接替换。
+    写端进程在写入中途被抢占时（例如 PsychoPy 占满 CPU），读端退避等待，最多 MAX_WAIT 秒。
+    """
+    MAX_WAIT = 0.5
+
+    def __init__(self, name):
+        self.shm = _attach(name)
+        self.header, self._data = _layout(self.shm)
+        self.n_channel = int(self.header[_N_CHANNEL])
+        self.capacity = int(self.header[_CAPACITY])
+        self.samplerate = int(self.header[_SAMPLERATE])
+        # local clear position, other readers are not affected
+        self._start = 0
+
+    @property
+    def n_samples(self):
+        """累计写入的样本数"""
+        return int(self.header[_TOTAL])
+
+    def _region(self, n, total):
+        available = min(total - self._start, self.capacity)
+        if n is None or n > available:
+            n = available
+        end = total % self.capacity + self.capacity
+        return self._data[:, end - n:end]
+
+    def read_latest(self, n=None, copy=True):
+        """读取最近 n 个样本
+        Args:
+            n (int or None): 样本数，None 表示读取全部可用数据
+            copy (bool): False 时返回共享内存视图
+        Returns:
+            total (int): 读取时的累计样本数，最后一个样本的序号为 total - 1
+            data (ndarray): (n_channel, n)
+        """
+        deadline = time.monotonic() + self.MAX_WAIT
+        delay = 0.
+        while True:
+            seq = int(self.header[_SEQ])
+            # odd sequence: writer in progress
+            if seq % 2 == 0:
+                total = int(self.header[_TOTAL])
+                data = self._region(n, total)
+                if not copy:
+                    return total, data
+                data = data.copy()
+                if int(self.header[_SEQ]) == seq:
+                    return total, data
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'no consistent copy of the sample bus within {self.MAX_WAIT}s, '
+                                   'the publisher may be stalled')
+            # yield first, then back off up to 1ms
+            time.sleep(delay)
+            delay = min(max(2 * delay, 5e-5), 1e-3)
+
+    def overwritten(self, total, n):
+        """以 read_latest 返回的 total 和样本数 n 判断视图是否已被写端覆盖"""
+        return self.n_samples - total > self.capacity - n
+
+    def get_trial_data(self, clear=False):
+        """
+        called to copy trial data from the bus
+        :args
+            clear (bool): only affects this reader
+        :return:
+            samplerate: number, samplerate
+            events: ndarray (n_events, 3), [onset, duration, event_label]
+            data: ndarray with shape of (channels, timesteps)
+        """
+        total, data = self.read_latest(copy=True)
+        if clear:
+            self._start = total
+        trigger_channel = data[-1]
+        onset = np.flatnonzero(trigger_channel)
+        event_label = trigger_channel[onset]
+        events = np.stack((onset, np.zeros_like(onset), event_label), axis=1)
+        return self.samplerate, events, data[:-1]
+
+    def close(self):
+        self.header = None
+        self._data = None
+        self.shm.close()
+
+
+class SampleBusPublisher:
+    """独占放大器 socket 的发布进程
+    在子进程中接收、解析并高通滤波数据，写入共享内存；
+    PsychoPy 范式、Qt 界面和在线解码进程通过 SampleBusReader(publisher.name) 读取同一份数据。
+    """
+    def __init__(self, n_channel=9, samplerate=1000, host='localhost', port=8712, buffer_len=1., name=None):
+        self.n_channel = n_channel
+        self.samplerate = samplerate
+        self.capacity = int(buffer_len * samplerate)
+        self._host = host
+        self._port = port
+        size = _HEADER_LEN * 8 + n_channel * 2 * self.capacity * 4
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.shm.buf[:size] = bytes(size)
+        header, _ = _layout(self.shm, n_channel, self.capacity)
+        header[_N_CHANNEL] = n_channel
+        header[_CAPACITY] = self.capacity
+        header[_SAMPLERATE] = samplerate
+        self._stop_event = multiprocessing.Event()
+        self._process = multiprocessing.Process(
+            target=_publish,
+            args=(self.shm.name, n_channel, samplerate, host, port, self._stop_event),
+            daemon=True)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def start(self):
+        self._process.start()
+
+    def is_active(self):
+        return self._process.is_alive()
+
+    def close(self, timeout=2.):
+        self._stop_event.set()
+        if self._process.is_alive():
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _publish(name, n_channel, samplerate, host, port, stop_event):
+    writer = SampleBusWriter(name)
+    chunk_size = int(NeuracleDataClient.UPDATE_INTERVAL * samplerate * NeuracleDataClient.BYTES_PER_NUM * n_channel)
+    assembler = FrameAssembler(NeuracleDataClient.BYTES_PER_NUM * n_channel, chunk_size)
+    filter_chain = OnlineFilterChain(samplerate)
+    sock = socket.create_connection((host, port))
+    # periodically wake up to check the stop event
+    sock.settimeout(0.2)
+    try:
+        while not stop_event.is_set():
+            try:
+                frames = assembler.recv_into(sock)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                logger.warning(f'amplifier connection lost: {e}')
+                break
+            if frames is None:
+                break
+            if len(frames) == 0:
+                continue
+            data = unpack_data(frames, n_channel)
+            data[:, :-1] = filter_chain.filter_incoming(data[:, :-1])
+            writer.write(data.T)
+    finally:
+        sock.close()
+        writer.close()
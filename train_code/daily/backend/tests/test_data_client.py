@@ -0,0 +1,448 @@
+import os
+import unittest
+import time
+import shutil
+import tempfile
+import socket
+import threading
+import asyncio
+import numpy as np
+import mne
+from device.data_client import NeuracleDataClient, RingBuffer, EventLog, FrameAssembler, OnlineFilterChain
+from bci_core.feature_extractors import LFPExtractor
+from device.async_data_client import AsyncNeuracleDataClient
+from device.sample_bus import SampleBusPublisher, SampleBusReader
+from device.neuracle_server import NeuracleSimServer, SyntheticSource
+from device.recorder import FrameRecorder
+from dataloaders.neo import load_neuracle
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_read_latest(self):
+        buffer = RingBuffer(3, 10)
+        stream = np.arange(3 * 27, dtype=np.float32).reshape((3, 27))
+        for i in range(0, 27, 4):
+            buffer.write(stream[:, i:i + 4])
+        self.assertEqual(len(buffer), 10)
+        self.assertTrue(np.array_equal(buffer.read_latest(), stream[:, -10:]))
+        self.assertTrue(np.array_equal(buffer.read_latest(3), stream[:, -3:]))
+        # the latest samples are always contiguous, a view can be returned
+        view = buffer.read_latest(7, copy=False)
+        self.assertFalse(view.flags['OWNDATA'])
+        self.assertTrue(np.array_equal(view, stream[:, -7:]))
+
+    def test_overflow_and_clear(self):
+        buffer = RingBuffer(2, 5)
+        block = np.arange(2 * 12, dtype=np.float32).reshape((2, 12))
+        buffer.write(block)
+        self.assertTrue(np.array_equal(buffer.read_latest(), block[:, -5:]))
+        buffer.clear()
+        self.assertEqual(buffer.read_latest().shape, (2, 0))
+
+
+class TestOnlineFilterChain(unittest.TestCase):
+    def test_streaming_matches_batch(self):
+        fs = 1000
+        t = np.arange(4 * fs) / fs
+        x = np.stack([np.sin(2 * np.pi * 50 * t) + 1., np.sin(2 * np.pi * 100 * t) + np.sin(2 * np.pi * 20 * t)], axis=1)
+        chain = OnlineFilterChain(fs)
+        y = np.concatenate([chain.filter_incoming(x[i:i + 40]) for i in range(0, len(x), 40)], axis=0)
+        chain.reset()
+        self.assertEqual(y.shape, x.shape)
+        self.assertTrue(np.allclose(y, chain.filter_incoming(x)))
+        # line noise and baseline are removed, 20Hz survives
+        y = y[-fs:]
+        self.assertLess(np.abs(y[:, 0]).max(), 0.05)
+        self.assertTrue(np.allclose(y[:, 1], x[-fs:, 1] - np.sin(2 * np.pi * 100 * t[-fs:]), atol=0.1))
+
+    def test_bands(self):
+        fs = 1000
+        bands = [(15, 35), (35, 50)]
+        x = np.random.default_rng(0).standard_normal((3 * fs, 4))
+        chain = OnlineFilterChain(fs, bands=bands)
+        y, band_y = [], []
+        for i in range(0, len(x), 40):
+            y.append(chain.filter_incoming(x[i:i + 40]))
+            band_y.append(chain.filter_bands(y[-1]))
+        y, band_y = np.concatenate(y), np.concatenate(band_y)
+        self.assertEqual(band_y.shape, (len(x), 8))
+        # same filters as the causal low frequency features
+        ref = LFPExtractor(fs, bands, phase='forward').transform(y.T)
+        self.assertTrue(np.allclose(band_y.T, ref, atol=1e-12))
+
+
+class TestEventLog(unittest.TestCase):
+    def test_since(self):
+        log = EventLog(capacity=2)
+        trigger = np.zeros(100)
+        trigger[[5, 40, 41, 90]] = [1, 2, 3, 4]
+        for offset in range(0, 300, 100):
+            log.extend(trigger, offset)
+        self.assertEqual(len(log), 12)
+        events = log.since(140)
+        self.assertTrue(np.array_equal(events[:, 0], [140, 141, 190, 205, 240, 241, 290]))
+        self.assertTrue(np.array_equal(events[:, 2], [2, 3, 4, 1, 2, 3, 4]))
+        self.assertEqual(len(log.since(291)), 0)
+
+
+class TestFrameAssembler(unittest.TestCase):
+    def test_split_packets(self):
+        n_channel = 3
+        stream = np.arange(n_channel * 50, dtype='<f').tobytes()
+        sender, receiver = socket.socketpair()
+        assembler = FrameAssembler(n_channel * 4, 64)
+        received = bytearray()
+        try:
+            # cut the stream at positions unrelated to the frame boundary
+            for start, end in [(0, 7), (7, 30), (30, 31), (31, 100), (100, len(stream))]:
+                sender.sendall(stream[start:end])
+                while len(received) + assembler.pending_bytes < end:
+                    frames = assembler.recv_into(receiver)
+                    self.assertEqual(len(frames) % (n_channel * 4), 0)
+                    received.extend(frames)
+            sender.close()
+            self.assertIsNone(assembler.recv_into(receiver))
+        finally:
+            receiver.close()
+        self.assertEqual(bytes(received), stream)
+        self.assertEqual(assembler.n_frames, 50)
+        self.assertEqual(assembler.dropped_bytes, 0)
+        self.assertGreater(assembler.split_reads, 0)
+
+
+class TestAsyncClient(unittest.TestCase):
+    def test_blocks_and_window(self):
+        n_channel, fs = 3, 1000
+        stream = np.random.randn(500, n_channel).astype('<f')
+        stream[:, -1] = 0
+        stream[[100, 300], -1] = [1, 2]
+
+        async def serve(reader, writer):
+            # odd-sized writes, the client must still see whole blocks
+            payload = stream.tobytes()
+            for i in range(0, len(payload), 1000):
+                writer.write(payload[i:i + 1000])
+                await writer.drain()
+                await asyncio.sleep(0.001)
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(serve, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with AsyncNeuracleDataClient(n_channel, fs, host='127.0.0.1', port=port, buffer_len=1.) as client:
+                n_received = 0
+                async for block in client:
+                    self.assertEqual(block.shape[0], n_channel)
+                    n_received += block.shape[1]
+                _, events, data = await client.window(0.5)
+            server.close()
+            await server.wait_closed()
+            return n_received, events, data
+
+        n_received, events, data = asyncio.run(run())
+        self.assertEqual(n_received, 500)
+        self.assertEqual(data.shape, (n_channel - 1, 500))
+        self.assertTrue(np.allclose(events[:, [0, 2]], [[100, 1], [300, 2]]))
+
+    def test_window_loop_yields(self):
+        n_channel, fs = 3, 1000
+        stream = np.random.randn(2000, n_channel).astype('<f')
+        stream[:, -1] = 0
+
+        async def serve(reader, writer):
+            payload = stream.tobytes()
+            for i in range(0, len(payload), 40 * n_channel * 4):
+                writer.write(payload[i:i + 40 * n_channel * 4])
+                await writer.drain()
+                await asyncio.sleep(0.001)
+            await asyncio.sleep(0.5)
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(serve, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            ends = []
+            async with AsyncNeuracleDataClient(n_channel, fs, host='127.0.0.1', port=port, buffer_len=1.) as client:
+                await client.window(0.1)
+                # a decision loop that never awaits anything else
+                for _ in range(5):
+                    await client.window(0.1)
+                    ends.append(client.n_samples)
+            server.close()
+            await server.wait_closed()
+            return ends
+
+        ends = asyncio.run(run())
+        # every window contains new samples, the receive task keeps running
+        self.assertTrue(np.all(np.diff(ends) > 0))
+
+
+class TestSampleBus(unittest.TestCase):
+    def test_publish_and_read(self):
+        n_channel, fs = 3, 1000
+        stream = np.random.randn(2000, n_channel).astype('<f')
+        stream[:, -1] = 0
+        stream[-100, -1] = 7
+
+        server = socket.create_server(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        publisher = SampleBusPublisher(n_channel, fs, host='127.0.0.1', port=port, buffer_len=1.)
+        publisher.start()
+        conn, _ = server.accept()
+        try:
+            conn.sendall(stream.tobytes())
+            reader = SampleBusReader(publisher.name)
+            for _ in range(100):
+                if reader.n_samples == len(stream):
+                    break
+                time.sleep(0.02)
+            self.assertEqual(reader.n_samples, len(stream))
+            total, view = reader.read_latest(200, copy=False)
+            self.assertFalse(view.flags['OWNDATA'])
+            self.assertFalse(reader.overwritten(total, 200))
+            fs_read, events, data = reader.get_trial_data()
+            self.assertEqual(fs_read, fs)
+            self.assertEqual(data.shape, (n_channel - 1, fs))
+            self.assertTrue(np.allclose(events[:, [0, 2]], [[fs - 100, 7]]))
+            reader.close()
+        finally:
+            conn.close()
+            server.close()
+            publisher.close()
+
+    def test_stalled_writer(self):
+        publisher = SampleBusPublisher(3, 1000, buffer_len=0.1)
+        reader = SampleBusReader(publisher.name)
+        try:
+            # a publisher preempted in the middle of a write
+            reader.header[0] += 1
+            threading.Timer(0.05, lambda: reader.header.__setitem__(0, reader.header[0] + 1)).start()
+            total, data = reader.read_latest()
+            self.assertEqual(data.shape, (3, 0))
+            reader.header[0] += 1
+            reader.MAX_WAIT = 0.05
+            with self.assertRaises(RuntimeError):
+                reader.read_latest()
+        finally:
+            reader.close()
+            publisher.close()
+
+
+class TestNeuracleSimServer(unittest.TestCase):
+    def test_client_against_sim_server(self):
+        n_channel, fs = 9, 1000
+        source = SyntheticSource(n_channel, fs, trigger_interval=0.3, trigger_codes=(1, 2, 3), seed=0)
+        with NeuracleSimServer(source, port=0, speed=10, jitter=0.001, fragment=True, seed=0) as server:
+            client = NeuracleDataClient(n_channel, fs, host=server.host, port=server.port, buffer_len=1.)
+            try:
+                time.sleep(0.5)
+                fs_read, events, data = client.get_trial_data()
+                abs_events = client.get_events()
+                time.sleep(0.2)
+                # events already seen keep their absolute onsets
+                self.assertTrue(np.array_equal(client.get_events()[:len(abs_events)], abs_events))
+                self.assertEqual(len(client.get_events(since=client.n_samples)), 0)
+                stats = client.stats()
+            finally:
+                client.close()
+        self.assertGreater(stats['n_packets'], 10)
+        self.assertEqual(stats['buffer_fill'], 1.)
+        self.assertGreater(stats['bytes_mean'], 0)
+        # 10x real time, 40ms packets
+        self.assertLess(stats['interval_mean'], 0.02)
+        self.assertLess(stats['age'], 0.5)
+        self.assertEqual(fs_read, fs)
+        self.assertEqual(data.shape, (n_channel - 1, fs))
+        self.assertEqual(client.assembler.dropped_bytes, 0)
+        self.assertGreater(len(events), 1)
+        self.assertTrue(np.all(np.isin(events[:, 2], (1, 2, 3))))
+        self.assertTrue(np.all(np.diff(events[:, 0]) == 300))
+        # the device does not remove the baseline, the client high-passes it
+        self.assertLess(np.abs(data[:, -200:].mean()), 1e-4)
+
+    def test_reconnect(self):
+        n_channel, fs = 9, 1000
+        source = SyntheticSource(n_channel, fs, trigger_interval=None, seed=0)
+        with NeuracleSimServer(source, port=0, seed=0) as server:
+            client = NeuracleDataClient(n_channel, fs, host=server.host, port=server.port, buffer_len=2.)
+            try:
+                time.sleep(0.3)
+                # amplifier software restarts
+                server.drop_clients()
+                time.sleep(0.6)
+                self.assertTrue(client.is_active())
+                _, _, data, gap_mask = client.get_trial_data(return_gap_mask=True)
+                stats = client.stats()
+            finally:
+                client.close()
+        self.assertEqual(client.n_reconnects, 1)
+        self.assertEqual(len(client.gaps), 1)
+        self.assertGreater(client.gaps[0][1], 0)
+        self.assertEqual(stats['gap_samples'], client.gaps[0][1])
+        # the hole is explicit in the buffer, samples before and after are kept
+        n_nan = np.isnan(data[0]).sum()
+        self.assertEqual(n_nan, client.gaps[0][1])
+        self.assertTrue(np.array_equal(gap_mask, np.isnan(data[0])))
+        self.assertGreater(data.shape[1], n_nan)
+
+    def test_band_buffer(self):
+        n_channel, fs = 9, 1000
+        bands = [(15, 35), (35, 50)]
+        source = SyntheticSource(n_channel, fs, trigger_interval=0.3, trigger_codes=(1, 2, 3), seed=0)
+        with NeuracleSimServer(source, port=0, speed=5, seed=0) as server:
+            client = NeuracleDataClient(n_channel, fs, host=server.host, port=server.port, buffer_len=10.,
+                                        filter_chain=OnlineFilterChain(fs, bands=bands))
+            time.sleep(0.5)
+            # both buffers stay readable and aligned once acquisition stops
+            client.close()
+        _, events, data = client.get_trial_data()
+        _, band_events, band_data = client.get_band_data()
+        self.assertEqual(band_data.shape, (len(bands) * (n_channel - 1), data.shape[1]))
+        self.assertTrue(np.array_equal(events, band_events))
+        # the buffer holds the whole session, filtered once on arrival
+        ref = LFPExtractor(fs, bands, phase='forward').transform(data.astype(float))
+        self.assertTrue(np.allclose(band_data, ref, atol=1e-3 * np.abs(ref).max()))
+
+    def test_drop_before_first_packet(self):
+        n_channel, fs = 3, 1000
+        stream = np.random.randn(200, n_channel).astype('<f')
+        stream[:, -1] = 0
+        server = socket.create_server(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+
+        def serve():
+            # the first connection closes before sending anything
+            conn, _ = server.accept()
+            conn.close()
+            conn, _ = server.accept()
+            conn.sendall(stream.tobytes())
+            time.sleep(0.5)
+            conn.close()
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        client = NeuracleDataClient(n_channel, fs, host='127.0.0.1', port=port, buffer_len=1.)
+        try:
+            for _ in range(50):
+                if client.n_samples == len(stream):
+                    break
+                time.sleep(0.02)
+            self.assertTrue(client.is_active())
+            self.assertEqual(client.n_reconnects, 1)
+            self.assertEqual(client.n_samples, len(stream))
+            self.assertEqual(client.gaps, [])
+        finally:
+            client.close()
+            thread.join()
+            server.close()
+
+    def test_receive_thread_error(self):
+        class BrokenFilter:
+            def filter_incoming(self, data):
+                raise ValueError('broken filter')
+
+        n_channel, fs = 9, 1000
+        source = SyntheticSource(n_channel, fs, seed=0)
+        with NeuracleSimServer(source, port=0, seed=0) as server:
+            with self.assertLogs('device.data_client', level='ERROR'):
+                client = NeuracleDataClient(n_channel, fs, host=server.host, port=server.port,
+                                            filter_chain=BrokenFilter())
+                time.sleep(0.3)
+            try:
+                self.assertFalse(client.is_active())
+            finally:
+                client.close()
+
+    def test_close_without_server(self):
+        n_channel, fs = 9, 1000
+        source = SyntheticSource(n_channel, fs, seed=0)
+        server = NeuracleSimServer(source, port=0, seed=0).start()
+        client = NeuracleDataClient(n_channel, fs, host=server.host, port=server.port)
+        time.sleep(0.1)
+        server.close()
+        time.sleep(0.3)
+        t = time.monotonic()
+        client.close()
+        self.assertLess(time.monotonic() - t, 1.)
+        self.assertFalse(client.is_active())
+
+    def test_recording(self):
+        n_channel, fs = 9, 1000
+        source = SyntheticSource(n_channel, fs, trigger_interval=0.3, trigger_codes=(1, 2, 3), seed=0)
+        record_dir = tempfile.mkdtemp()
+        try:
+            with NeuracleSimServer(source, port=0, speed=10, seed=0) as server:
+                client = NeuracleDataClient(n_channel, fs, host=server.host, port=server.port, buffer_len=1.,
+                                            record_dir=record_dir)
+                time.sleep(0.5)
+                client.close()
+            n_samples = client.recorder.n_samples
+            self.assertGreater(n_samples, fs)
+
+            raw = load_neuracle(record_dir)
+            self.assertEqual(raw.info['sfreq'], fs)
+            self.assertEqual(raw.get_data().shape, (n_channel - 1, n_samples))
+            events, _ = mne.events_from_annotations(raw, event_id=lambda d: int(d), verbose=False)
+            self.assertTrue(np.all(np.isin(events[:, 2], (1, 2, 3))))
+            self.assertTrue(np.all(np.diff(events[:, 0]) == 300))
+        finally:
+            shutil.rmtree(record_dir)
+
+
+class TestFrameRecorder(unittest.TestCase):
+    def test_grow_and_load(self):
+        n_channel, fs = 3, 100
+        stream = np.random.randn(1000, n_channel).astype('<f')
+        stream[:, -1] = 0
+        stream[[10, 500], -1] = [4, 5]
+        record_dir = tempfile.mkdtemp()
+        try:
+            # preallocate 0.5s only, the file has to grow several times
+            recorder = FrameRecorder(record_dir, n_channel, fs, initial_duration=0.5)
+            for i in range(0, len(stream), 40):
+                recorder.put(stream[i:i + 40].tobytes())
+            recorder.close()
+            self.assertEqual(os.path.getsize(os.path.join(record_dir, FrameRecorder.DATA_FILE)), stream.nbytes)
+            raw = load_neuracle(record_dir)
+            self.assertTrue(np.allclose(raw.get_data(), stream[:, :-1].T * 1e-6))
+            self.assertTrue(np.allclose(raw.annotations.onset, [0.1, 5.]))
+        finally:
+            shutil.rmtree(record_dir)
+
+    def test_dropped_frames(self):
+        n_channel, fs = 3, 100
+        stream = np.random.randn(400, n_channel).astype('<f')
+        stream[:, -1] = 0
+        stream[[10, 330], -1] = [4, 5]
+        record_dir = tempfile.mkdtemp()
+        try:
+            recorder = FrameRecorder(record_dir, n_channel, fs, queue_size=1)
+            # a writer stuck on the disk while the first block is written
+            release = threading.Event()
+            write = recorder._write
+            def slow_write(data):
+                release.wait()
+                write(data)
+            recorder._write = slow_write
+            for i in range(0, len(stream), 40):
+                if i == 160:
+                    release.set()
+                if i not in (80, 120):
+                    while not recorder._queue.empty():
+                        time.sleep(0.01)
+                recorder.put(stream[i:i + 40].tobytes())
+            recorder.close()
+            # blocks 0 and 1 are written, 2 and 3 are dropped
+            self.assertEqual(recorder.dropped_samples, 80)
+            self.assertEqual(recorder.dropped_segments, [[80, 80]])
+            raw = load_neuracle(record_dir)
+            data = raw.get_data()
+            self.assertEqual(data.shape, (n_channel - 1, len(stream)))
+            self.assertTrue(np.all(np.isnan(data[:, 80:160])))
+            kept = np.r_[0:80, 160:len(stream)]
+            self.assertTrue(np.allclose(data[:, kept], stream[kept, :-1].T * 1e-6))
+            # samples after the drop keep their offsets
+            self.assertTrue(np.allclose(raw.annotations.onset, [0.1, 0.8, 3.3]))
+            self.assertEqual(list(raw.annotations.description), ['4', 'BAD_dropped', '5'])
+        finally:
+            shutil.rmtree(record_dir)
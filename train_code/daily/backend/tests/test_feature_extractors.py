@@ -0,0 +1,150 @@
+import pickle
+import unittest
+import warnings
+import numpy as np
+from mne import filter
+from mne.time_frequency import tfr_array_morlet
+from bci_core.feature_extractors import FIRFilterBank, FeatExtractor, FilterbankExtractor, HGExtractor, MorletBank, StreamingLFPExtractor, fast_hilbert
+
+
+class TestHGExtractor(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fs = 1000
+        cls.hg_bands = [(55, 95), (105, 145)]
+        cls.data = np.random.default_rng(0).standard_normal((8, cls.fs))
+
+    def test_filter_bank_matches_mne(self):
+        bank = FIRFilterBank(self.fs, self.hg_bands)
+        # also a window shorter than the kernels
+        for n_times in (self.fs, 100):
+            data = self.data[:, :n_times]
+            filtered = bank.transform(data)
+            for b, band_data in zip(self.hg_bands, filtered):
+                with warnings.catch_warnings():
+                    # mne warns about the kernel being longer than the signal
+                    warnings.simplefilter('ignore')
+                    ref = filter.filter_data(data, self.fs, b[0], b[1], verbose=False)
+                self.assertTrue(np.allclose(band_data, ref, atol=1e-12))
+
+    def test_transform(self):
+        ref = np.concatenate([np.abs(fast_hilbert(filter.filter_data(self.data, self.fs, b[0], b[1], verbose=False)))
+                              for b in self.hg_bands], axis=0)
+        ext = HGExtractor(self.fs, self.hg_bands, envelope='hilbert')
+        self.assertTrue(np.allclose(ext.transform(self.data), ref, atol=1e-12))
+        # the fused envelope only differs in edge handling (reflected data instead of zero padding)
+        ext = HGExtractor(self.fs, self.hg_bands, envelope='fft')
+        env = ext.transform(self.data)
+        self.assertEqual(env.shape, ref.shape)
+        rel_err = np.abs(env - ref)[:, 100:-100] / ref.mean()
+        self.assertLess(rel_err.max(), 0.05)
+
+    def test_envelope_plan_cache_is_bounded(self):
+        bank = FIRFilterBank(self.fs, self.hg_bands)
+        ref = bank.envelope(self.data)
+        # recordings of different lengths and batch sizes
+        for n_times in range(500, 1000, 50):
+            bank.envelope(self.data[:, :n_times])
+            bank.envelope(np.stack([self.data[:, :n_times]] * 3))
+        self.assertLessEqual(len(bank._envelope_plans), bank.MAX_ENVELOPE_PLANS)
+        self.assertTrue(np.array_equal(bank.envelope(np.stack([self.data] * 2))[:, 1], ref))
+        self.assertTrue(np.array_equal(bank.envelope(self.data), ref))
+
+
+class TestStreamingLFPExtractor(unittest.TestCase):
+    def test_step_matches_transform(self):
+        fs = 1000
+        data = np.random.default_rng(0).standard_normal((8, 3 * fs))
+        bands = [(15, 35), (35, 50)]
+        ext = StreamingLFPExtractor(fs, bands, window_length=fs)
+        for i in range(0, data.shape[1], 40):
+            window = ext.step(data[:, i:i + 40])
+        self.assertEqual(window.shape, (16, fs))
+        self.assertTrue(np.allclose(window, ext.transform(data)[:, -fs:]))
+        # same filters as the offline causal features the model is trained on
+        ref = np.concatenate([filter.filter_data(data, fs, *b, method='iir', phase='forward', verbose=False)
+                              for b in bands], axis=0)
+        self.assertTrue(np.allclose(ext.transform(data), ref, atol=1e-12))
+        offline = FeatExtractor(fs, bands, None, lfb_phase='forward').transform(data)
+        self.assertTrue(np.allclose(window, offline[:, -fs:], atol=1e-12))
+        # state is cleared
+        ext.reset()
+        window = ext.step(data[:, :100])
+        self.assertTrue(np.allclose(window[:, -100:], ext.transform(data[:, :100])))
+        self.assertTrue(np.all(window[:, :-100] == 0))
+
+
+
+class TestFeatExtractor(unittest.TestCase):
+    def test_batched_transform(self):
+        fs = 1000
+        epochs = np.random.default_rng(0).standard_normal((5, 4, 500))
+        ext = FeatExtractor(fs, [(2, 15), (20, 35)], [(55, 95), (105, 145)])
+        feat = ext.transform(epochs)
+        self.assertEqual(feat.shape, (5, 16, 500))
+        for x, f in zip(epochs, feat):
+            self.assertTrue(np.allclose(ext.transform(x), f, atol=1e-12))
+        # low frequency bands still match mne
+        ref = np.concatenate([filter.filter_data(epochs[0], fs, *b, method='iir', verbose=False)
+                              for b in [(2, 15), (20, 35)]], axis=0)
+        self.assertTrue(np.allclose(feat[0, :8], ref, atol=1e-12))
+
+
+class TestFeatExtractorDecimation(unittest.TestCase):
+    def test_lfb_bands_must_survive_decimation(self):
+        with self.assertRaises(ValueError):
+            FeatExtractor(1000, [(15, 35), (35, 50)], [(55, 95)], target_fs=10)
+        data = np.random.default_rng(0).standard_normal((4, 1000))
+        features = FeatExtractor(1000, None, [(55, 95), (105, 145)], target_fs=10).transform(data)
+        self.assertEqual(features.shape, (8, 10))
+        features = FeatExtractor(1000, [(1, 4)], None, target_fs=10).transform(data)
+        self.assertEqual(features.shape, (4, 10))
+
+
+class TestFilterbankExtractor(unittest.TestCase):
+    def test_wavelet_bank_matches_mne(self):
+        fs = 1000
+        freqs = np.arange(20, 150, 15)
+        data = np.random.default_rng(0).standard_normal((4, fs))
+        ref = tfr_array_morlet(data[None], fs, freqs, n_cycles=freqs / 4, output='avg_power', verbose=False)
+        ext = FilterbankExtractor(fs, freqs)
+        power = ext.transform(data)
+        self.assertEqual(power.shape, (4 * len(freqs), fs))
+        self.assertTrue(np.allclose(power, ref.reshape((-1, fs)), rtol=1e-10, atol=0))
+
+    def test_wavelet_bank_chunks_and_plans(self):
+        fs = 1000
+        freqs = np.arange(20, 150, 15)
+        bank = MorletBank(fs, freqs, freqs / 4)
+        data = np.random.default_rng(0).standard_normal((4, fs))
+        power = bank.power(data)
+        tfr = bank.transform(data)
+        # one frequency at a time, as for whole recordings
+        bank.MAX_CHUNK_SIZE = 1
+        self.assertTrue(np.allclose(bank.power(data), power, rtol=1e-12, atol=0))
+        self.assertTrue(np.allclose(bank.transform(data), tfr, rtol=1e-12, atol=0))
+        self.assertTrue(np.allclose(np.abs(tfr) ** 2, power))
+        # whole recordings: spectra are built per chunk and not cached
+        bank._plans.clear()
+        self.assertTrue(np.allclose(bank.power(data), power, rtol=1e-12, atol=0))
+        self.assertEqual(len(bank._plans), 0)
+        bank.MAX_CHUNK_SIZE = MorletBank.MAX_CHUNK_SIZE
+        for n_times in range(100, 100 + 2 * MorletBank.MAX_PLANS):
+            bank.power(data[:, :n_times])
+        self.assertEqual(len(bank._plans), MorletBank.MAX_PLANS)
+        self.assertEqual(list(bank._plans)[-1], 100 + 2 * MorletBank.MAX_PLANS - 1)
+
+    def test_thread_pool(self):
+        epochs = np.random.default_rng(0).standard_normal((3, 4, 500))
+        serial = FeatExtractor(1000, [(2, 15), (20, 35)], [(55, 95), (105, 145)])
+        threaded = FeatExtractor(1000, [(2, 15), (20, 35)], [(55, 95), (105, 145)], n_workers=3)
+        self.assertTrue(np.array_equal(serial.transform(epochs), threaded.transform(epochs)))
+        # the pool is reused and not pickled
+        pool = threaded._executor
+        threaded.transform(epochs[0])
+        self.assertIs(threaded._executor, pool)
+        restored = pickle.loads(pickle.dumps(threaded))
+        self.assertIsNone(restored._executor)
+        self.assertTrue(np.array_equal(serial.transform(epochs), restored.transform(epochs)))
+        threaded.close()
+        restored.close()
@@ -0,0 +1,21 @@
+import unittest
+import numpy as np
+from scipy import signal
+from bci_core import fft_utils
+
+
+class TestFFTUtils(unittest.TestCase):
+    def test_workers(self):
+        x = np.random.default_rng(0).standard_normal((4, 1000))
+        ref = np.fft.rfft(x, 1024)
+        self.assertTrue(np.allclose(fft_utils.rfft(x, 1024), ref))
+        fft_utils.set_workers(2)
+        try:
+            self.assertTrue(np.allclose(fft_utils.irfft(ref, 1024)[:, :1000], x))
+        finally:
+            fft_utils.set_workers(1)
+
+    def test_analytic_signal(self):
+        x = np.random.default_rng(0).standard_normal((4, 1000))
+        for n_fft in (1000, 1024, 1125):
+            self.assertTrue(np.allclose(fft_utils.analytic_signal(x, n_fft), signal.hilbert(x, n_fft), atol=1e-12))
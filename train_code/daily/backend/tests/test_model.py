@@ -0,0 +1,66 @@
+import pickle
+import unittest
+import numpy as np
+from pyriemann.estimation import BlockCovariances
+from bci_core.model import SlidingBlockCovariances, OnlineRiemannEmbedder, riemann_feature_embedder, ChannelScaler
+
+
+class TestChannelScaler(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.X = rng.standard_normal((5, 6, 100)) * rng.uniform(0.5, 2, (1, 6, 1)) + rng.standard_normal((1, 6, 1))
+        self.expected = (self.X - self.X.mean(axis=(0, 2), keepdims=True)) / self.X.std(axis=(0, 2), keepdims=True)
+
+    def test_out_and_inplace(self):
+        scaler = ChannelScaler().fit(self.X)
+        X = self.X.copy()
+        self.assertTrue(np.allclose(scaler.transform(X), self.expected))
+        self.assertTrue(np.array_equal(X, self.X))
+        out = np.empty_like(X)
+        self.assertIs(scaler.transform(X, out=out), out)
+        self.assertTrue(np.allclose(out, self.expected))
+        scaler.set_params(copy=False)
+        self.assertIs(scaler.transform(X), X)
+        self.assertTrue(np.allclose(X, self.expected))
+        # dtype conversion always needs a new buffer
+        X_32 = self.X.astype(np.float32)
+        self.assertIsNot(scaler.set_params(dtype=np.float64).transform(X_32), X_32)
+
+    def test_old_pickle(self):
+        scaler = ChannelScaler().fit(self.X)
+        state = scaler.__getstate__()
+        for key in ('scale_', 'offset_', 'copy'):
+            del state[key]
+        old = ChannelScaler.__new__(ChannelScaler)
+        old.__setstate__(state)
+        restored = pickle.loads(pickle.dumps(old))
+        self.assertTrue(np.allclose(restored.transform(self.X), self.expected))
+
+
+class TestSlidingBlockCovariances(unittest.TestCase):
+    def test_matches_block_covariances(self):
+        rng = np.random.default_rng(0)
+        # offsets and scales like unnormalised envelopes
+        stream = rng.standard_normal((12, 4000)) * rng.uniform(0.5, 2, (12, 1)) + rng.standard_normal((12, 1))
+        ref_estimator = BlockCovariances([8, 4], estimator='lwf')
+        cov = SlidingBlockCovariances([8, 4], window_length=500)
+        cov.update(stream[:, :500])
+        end = 500
+        while end + 100 <= stream.shape[1]:
+            # the last 40 samples are recomputed, as with the sliding feature cache
+            stream[:, end - 40:end] += 0.1
+            cov.update(stream[:, end - 40:end + 100], n_replace=40)
+            end += 100
+            ref = ref_estimator.transform(stream[None, :, end - 500:end])[0]
+            self.assertTrue(np.allclose(cov.covariance(), ref, rtol=1e-10, atol=1e-12))
+
+    def test_online_embedder(self):
+        rng = np.random.default_rng(0)
+        epochs = rng.standard_normal((20, 8, 300))
+        embedder = riemann_feature_embedder([4, 4]).fit(epochs)
+        online = OnlineRiemannEmbedder(embedder, 300)
+        stream = rng.standard_normal((8, 1000))
+        online.step(stream[:, :300])
+        for end in range(350, 1000, 50):
+            X_embed = online.step(stream[:, end - 300:end], n_new=50, n_update=50)
+            self.assertTrue(np.allclose(X_embed, embedder.transform(stream[None, :, end - 300:end]), atol=1e-10))
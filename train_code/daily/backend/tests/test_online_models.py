@@ -0,0 +1,119 @@
+import unittest
+from unittest import mock
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from bci_core.feature_extractors import FeatExtractor, FilterbankExtractor
+from bci_core.model import SlidingBlockCovariances
+from bci_core.online import ClfEmissionHMM, SlidingFeatureCache
+from bci_core.pipeline import baseline_model_builder, riemann_model_builder
+
+
+def make_model(fs=1000, n_ch=4, n_times=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    y = np.arange(20) % 2
+    X = rng.standard_normal((len(y), n_ch, n_times)) * (1 + y[:, None, None])
+    feat_extractor, embedder = baseline_model_builder(fs)
+    clf = LogisticRegression(max_iter=1000).fit(embedder.fit_transform(feat_extractor.transform(X), y), y)
+    return [feat_extractor, embedder, clf], rng
+
+
+class TestSlidingFeatureCache(unittest.TestCase):
+    def _check(self, feat_extractor, window_length, rtol):
+        fs = 1000
+        stream = np.random.default_rng(0).standard_normal((4, 5 * fs))
+        cache = SlidingFeatureCache(feat_extractor)
+        # only the left edge differs, the cache has seen the samples before the window
+        edge = feat_extractor.edge_samples()
+        ends = range(window_length, stream.shape[1], 100)
+        for end in ends:
+            window = stream[:, end - window_length:end]
+            features = cache.transform(fs, window)
+            ref = feat_extractor.transform(window)
+            err = np.abs(features - ref)[:, edge:].max(axis=1) / np.abs(ref).max(axis=1)
+            self.assertLess(err.max(), rtol)
+        # discontinuous data falls back to a full window
+        features = cache.transform(fs, stream[:, :window_length])
+        self.assertTrue(np.array_equal(features, feat_extractor.transform(stream[:, :window_length])))
+        return cache.n_incremental, len(ends)
+
+    def test_filterbank_extractor(self):
+        n_incremental, n_steps = self._check(FilterbankExtractor(1000, np.arange(20, 150, 15)), 1000, 1e-10)
+        self.assertEqual(n_incremental, n_steps - 1)
+
+    def test_feat_extractor(self):
+        fs, window_length = 1000, 1000
+        feat_extractor = FeatExtractor(fs, [(15, 35), (35, 50)], [(55, 95), (105, 145)], lfb_phase='forward')
+        stream = np.random.default_rng(0).standard_normal((4, 5 * fs))
+        # the causal low frequency rows are streamed and match the features of the continuous recording
+        offline = feat_extractor.transform(stream)
+        cache = SlidingFeatureCache(feat_extractor)
+        edge = feat_extractor.hgs_extractor.edge_samples()
+        ends = range(window_length, stream.shape[1], 100)
+        for end in ends:
+            window = stream[:, end - window_length:end]
+            features = cache.transform(fs, window)
+            self.assertTrue(np.allclose(features[:8], offline[:8, end - window_length:end], atol=1e-12))
+            ref = feat_extractor.hgs_extractor.transform(window)
+            err = np.abs(features[8:] - ref)[:, edge:].max(axis=1) / np.abs(ref).max(axis=1)
+            # the Hilbert envelope has a slowly decaying tail beyond the FIR half kernel
+            self.assertLess(err.max(), 5e-3)
+        self.assertEqual(cache.n_incremental, len(ends) - 1)
+        self.assertEqual(cache.last_update, (100, 100 + edge))
+
+    def test_zero_phase_lfb(self):
+        feat_extractor = FeatExtractor(1000, [(15, 35), (35, 50)], [(55, 95), (105, 145)])
+        with self.assertRaises(ValueError):
+            SlidingFeatureCache(feat_extractor)
+        # explicit margins keep the approximate cache
+        SlidingFeatureCache(feat_extractor, margin=0.2, context=0.2)
+
+
+class TestOnlineCovariance(unittest.TestCase):
+    def test_incremental_updates(self):
+        fs, n_ch = 1000, 4
+        rng = np.random.default_rng(0)
+        y = np.arange(40) % 2
+        X = rng.standard_normal((len(y), n_ch, fs)) * (1 + y[:, None, None])
+        feat_extractor, embedder = riemann_model_builder(fs, n_ch, lfb_phase='forward')
+        clf = LogisticRegression(max_iter=1000).fit(embedder.fit_transform(feat_extractor.transform(X), y), y)
+        hmm = ClfEmissionHMM([feat_extractor, embedder, clf], use_feature_cache=True, use_online_covariance=True)
+
+        stream = rng.standard_normal((n_ch, 4 * fs))
+        with mock.patch.object(SlidingBlockCovariances, 'update', autospec=True,
+                               side_effect=SlidingBlockCovariances.update) as update, \
+                mock.patch.object(SlidingBlockCovariances, 'reset', autospec=True,
+                                  side_effect=SlidingBlockCovariances.reset) as reset:
+            for end in range(fs, stream.shape[1], 100):
+                p = hmm.step_probability(fs, stream[:, end - fs:end])
+                features = hmm.feature_cache._features
+                ref = clf.predict_proba(embedder.transform(features[None])).squeeze()
+                self.assertTrue(np.allclose(p, ref, atol=1e-8))
+                if end == fs:
+                    n_resets = reset.call_count
+        n_steps = len(range(fs, stream.shape[1], 100))
+        # one full window at the start, then only the new and recomputed samples are folded in
+        self.assertEqual(hmm.feature_cache.n_incremental, n_steps - 1)
+        self.assertEqual(reset.call_count, n_resets)
+        n_new, n_update = hmm.feature_cache.last_update
+        self.assertEqual(n_new, 100)
+        self.assertEqual([call.args[1].shape[1] for call in update.call_args_list[1:]], [n_update] * (n_steps - 1))
+        self.assertTrue(all(call.kwargs['n_replace'] == n_update - n_new for call in update.call_args_list[1:]))
+
+
+class TestGapWindows(unittest.TestCase):
+    def test_decision_over_gap(self):
+        fs = 1000
+        model, rng = make_model(fs)
+        hmm = ClfEmissionHMM(model)
+        window = rng.standard_normal((4, fs))
+        hmm.viterbi(fs, window)
+        probability = hmm.probability
+        # samples lost during reconnection are NaN in the client buffer
+        window[:, 300:420] = np.nan
+        p, decision = hmm.viterbi(fs, window, return_step_p=True)
+        self.assertTrue(np.all(np.isnan(p)))
+        self.assertEqual(decision, -1)
+        self.assertTrue(np.array_equal(hmm.probability, probability))
+        # decoding resumes once the gap leaves the window
+        hmm.viterbi(fs, rng.standard_normal((4, fs)))
+        self.assertTrue(np.all(np.isfinite(hmm.probability)))
@@ -0,0 +1,102 @@
+import unittest
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from bci_core.feature_extractors import FeatExtractor
+from bci_core.pipeline import riemann_model_builder, baseline_model_builder, data_evaluation, export_for_inference
+
+
+def make_epochs(fs, n_epochs=40, n_ch=8, n_times=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    y = np.arange(n_epochs) % 2
+    t = np.arange(n_times) / fs
+    X = rng.standard_normal((n_epochs, n_ch, n_times))
+    # class 1 has extra high gamma activity on the first channels
+    X[y == 1, :3] += 0.5 * np.sin(2 * np.pi * 80 * t + rng.uniform(0, 2 * np.pi, (int(y.sum()), 3, 1)))
+    # amplifier data: float32 in volts
+    return (X * 1e-5).astype(np.float32), y
+
+
+class TestPrecision(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fs = 1000
+        cls.X, cls.y = make_epochs(cls.fs)
+
+    def _fit(self, feat_extractor, embedder):
+        X_embed = embedder.fit_transform(feat_extractor.transform(self.X.astype(np.float64)), self.y)
+        clf = LogisticRegression(max_iter=1000).fit(X_embed, self.y)
+        return clf
+
+    def test_riemann_float32_drift(self):
+        feat_extractor, embedder = riemann_model_builder(self.fs)
+        clf = self._fit(feat_extractor, embedder)
+        prob_64 = data_evaluation([feat_extractor, embedder, clf], self.X, self.fs, return_cls=False,
+                                  dtype=np.float64)
+        feat_extractor_32 = FeatExtractor(self.fs, [(15, 35), (35, 50)], [(55, 95), (105, 145)], dtype=np.float32)
+        self.assertEqual(feat_extractor_32.transform(self.X).dtype, np.float32)
+        prob_32 = data_evaluation([feat_extractor_32, embedder, clf], self.X, self.fs, return_cls=False,
+                                  dtype=np.float32)
+        self.assertLess(np.abs(prob_32 - prob_64).max(), 1e-3)
+
+    def test_baseline_float32_drift(self):
+        feat_extractor, embedder = baseline_model_builder(self.fs)
+        clf = self._fit(feat_extractor, embedder)
+        prob_64 = data_evaluation([feat_extractor, embedder, clf], self.X, self.fs, return_cls=False)
+        embedder.set_params(decimatefeature__dtype=np.float32, channelscaler__dtype=np.float32)
+        self.assertEqual(embedder.transform(feat_extractor.transform(self.X[:2])).dtype, np.float32)
+        prob_32 = data_evaluation([feat_extractor, embedder, clf], self.X, self.fs, return_cls=False)
+        self.assertLess(np.abs(prob_32 - prob_64).max(), 1e-3)
+
+
+class TestDecimateEarly(unittest.TestCase):
+    def test_baseline_decimate_early(self):
+        fs = 1000
+        X, y = make_epochs(fs)
+        X = X.astype(np.float64)
+        late = baseline_model_builder(fs)
+        early = baseline_model_builder(fs, decimate_early=True)
+        feat_late = late[1][0].transform(late[0].transform(X))
+        feat_early = early[1][0].transform(early[0].transform(X))
+        self.assertEqual(feat_early.shape, feat_late.shape)
+        # both are 10 Hz power, edge samples differ with the anti-alias filters
+        corr = np.corrcoef(feat_early[..., 1:-1].ravel(), feat_late[..., 1:-1].ravel())[0, 1]
+        self.assertGreater(corr, 0.95)
+        for feat_extractor, embedder in (late, early):
+            clf = LogisticRegression(max_iter=1000).fit(embedder.fit_transform(feat_extractor.transform(X), y), y)
+            _, y_pred = data_evaluation([feat_extractor, embedder, clf], X, fs)
+            self.assertGreater(np.mean(y_pred == y), 0.9)
+
+
+class TestExportForInference(unittest.TestCase):
+    def test_riemann_probabilities(self):
+        fs = 1000
+        X, y = make_epochs(fs, n_epochs=30)
+        X = X.astype(np.float64)
+        feat_extractor, embedder = riemann_model_builder(fs)
+        for labels in (y, np.arange(len(y)) % 3):
+            X_embed = embedder.fit_transform(feat_extractor.transform(X), labels)
+            clf = LogisticRegression(max_iter=1000).fit(X_embed, labels)
+            model = [feat_extractor, embedder, clf]
+            compiled = export_for_inference(model)
+            self.assertIsNot(compiled[1], embedder)
+            prob, y_pred = data_evaluation(model, X, fs)
+            prob_compiled, y_pred_compiled = data_evaluation(compiled, X, fs)
+            self.assertTrue(np.allclose(prob, prob_compiled, rtol=0, atol=1e-12))
+            self.assertTrue(np.array_equal(y_pred, y_pred_compiled))
+
+    def test_baseline_affine_fusion(self):
+        fs = 1000
+        X, y = make_epochs(fs, n_epochs=30)
+        X = X.astype(np.float64)
+        feat_extractor, embedder = baseline_model_builder(fs)
+        for labels in (y, np.arange(len(y)) % 3):
+            X_embed = embedder.fit_transform(feat_extractor.transform(X), labels)
+            clf = LogisticRegression(max_iter=1000).fit(X_embed, labels)
+            model = [feat_extractor, embedder, clf]
+            compiled = export_for_inference(model)
+            # only the decimation is left before the fused linear classifier
+            self.assertEqual(len(compiled[1].steps), 1)
+            prob, y_pred = data_evaluation(model, X, fs)
+            prob_compiled, y_pred_compiled = data_evaluation(compiled, X, fs)
+            self.assertTrue(np.allclose(prob, prob_compiled, rtol=0, atol=1e-12))
+            self.assertTrue(np.array_equal(y_pred, y_pred_compiled))
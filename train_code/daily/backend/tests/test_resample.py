@@ -0,0 +1,61 @@
+import pickle
+import unittest
+import numpy as np
+from scipy import signal
+from bci_core import resample
+from bci_core.model import DecimateFeature
+
+
+class TestResample(unittest.TestCase):
+    def test_matches_scipy(self):
+        rng = np.random.default_rng(0)
+        for up, down in ((1, 100), (2, 3), (5, 7), (4, 1)):
+            # short windows use the cached matrix, long ones the direct polyphase path
+            for n_times in (5, 1000, 30000):
+                x = rng.standard_normal((3, n_times, 2)).cumsum(axis=1)
+                ref = signal.resample_poly(x, up, down, axis=1, padtype='line')
+                y = resample.resample_poly(x, up, down, axis=1)
+                self.assertEqual(y.shape, ref.shape)
+                self.assertTrue(np.allclose(y, ref, rtol=0, atol=1e-12 * np.abs(ref).max()))
+
+    def test_long_input(self):
+        # 5-20s continuous recordings must not go through a dense matrix
+        x = np.random.default_rng(0).standard_normal((4, 16000))
+        resample._resample_matrix.cache_clear()
+        y = resample.resample_poly(x, 1, 100)
+        self.assertEqual(resample._resample_matrix.cache_info().currsize, 0)
+        ref = signal.resample_poly(x, 1, 100, axis=-1, padtype='line')
+        self.assertTrue(np.allclose(y, ref, rtol=0, atol=1e-12))
+        # the cached matrix of a short window equals the direct path
+        matrix = resample._resample_matrix(300, 2, 3, None)
+        direct = resample._resample_direct(np.eye(300), 2, 3, None)
+        self.assertTrue(np.allclose(matrix, direct, rtol=0, atol=1e-12))
+
+    def test_streaming(self):
+        rng = np.random.default_rng(0)
+        x = rng.standard_normal((4, 5000)).cumsum(axis=-1)
+        for up, down in ((1, 100), (2, 3)):
+            stream = resample.StreamingResampler(up, down)
+            blocks, start = [], 0
+            while start < x.shape[-1]:
+                n_new = int(rng.integers(1, 200))
+                blocks.append(stream.step(x[:, start:start + n_new]))
+                start += n_new
+            y = np.concatenate(blocks, axis=-1)
+            ref = resample.resample_poly(x, up, down)
+            # everything after the left edge matches the batch result
+            skip = int(np.ceil(2 * stream.half_len / down)) + 1
+            self.assertEqual(y.shape[-1], stream.n_out)
+            self.assertTrue(np.allclose(y[:, skip:], ref[:, skip:y.shape[-1]], rtol=0, atol=1e-9))
+
+    def test_decimate_feature_method(self):
+        X = np.random.default_rng(0).standard_normal((2, 3, 1000))
+        feature = DecimateFeature(1000, 10)
+        self.assertTrue(np.allclose(feature.transform(X), signal.resample_poly(X, 1, 100, axis=-1, padtype='line')))
+        state = feature.__getstate__()
+        del state['method']
+        old = DecimateFeature.__new__(DecimateFeature)
+        old.__setstate__(state)
+        old = pickle.loads(pickle.dumps(old))
+        self.assertEqual(old.method, 'iir')
+        self.assertEqual(old.transform(X).shape, (2, 3, 10))